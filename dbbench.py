@@ -0,0 +1,349 @@
+# Running this file benchmarks the parsing of saved pdga event pages and the full standings pipeline
+# on synthetic seasons, offline and against a local sqlite database
+from dbscrape import parse_event_page, fetch_page, write_cache, set_offline, DEFAULT_PARSER
+import dbconn
+import dbmetrics
+import dbscrape
+import argparse
+import contextlib
+import datetime
+import glob
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# parsers that are compared, lxml is only available when it is installed
+PARSERS = ['lxml','html.parser'] if DEFAULT_PARSER == 'lxml' else ['html.parser']
+
+# share of the players of an event in each division of a synthetic season
+DIVISIONS = {'MPO': 0.5, 'FPO': 0.15, 'MA40': 0.2, 'MA50': 0.15}
+
+# first pdga number of the players of a synthetic season
+FIRST_PDGA_NUMBER = 100000
+
+def load_fixture(path:str) -> bytes:
+    """
+    Read a saved page, pages from the response cache are gzip compressed.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path,'rb') as f:
+        return f.read()
+
+def record_event_fixture(event_id:int,directory:str='fixtures') -> str:
+    """
+    Download an event page and save it as a fixture for the benchmarks.
+    """
+    os.makedirs(directory,exist_ok=True)
+    path = os.path.join(directory,'event_{}.html'.format(event_id))
+    with open(path,'wb') as f:
+        f.write(fetch_page('https://www.pdga.com/tour/event/' + str(event_id),'event'))
+    return path
+
+def bench_parse(paths:list,parsers:list=PARSERS,repeat:int=5) -> list:
+    """
+    Time the parsing of each saved event page with each parser.
+    Return a list of dictionaries with the fixture, parser, number of result rows and seconds per parse.
+    """
+    results = []
+    for path in paths:
+        content = load_fixture(path)
+        for parser in parsers:
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(repeat):
+                    _, tournaments_df = parse_event_page(content,parser=parser)
+            seconds = (time.perf_counter() - start_time)/repeat
+            results.append({'fixture': os.path.basename(path), 'parser': parser,
+                            'rows': len(tournaments_df), 'seconds': seconds})
+    print('{:<30} {:<12} {:>6} {:>10}'.format('fixture','parser','rows','ms/event'))
+    for result in results:
+        print('{:<30} {:<12} {:>6} {:>10.1f}'.format(result['fixture'],result['parser'],result['rows'],result['seconds']*1000))
+    return results
+
+# synthetic seasons
+def synthetic_event_page(event_id:int,players:list,rng:random.Random) -> bytes:
+    """
+    Create the html of an event page with the structure of the pdga event pages for the given players,
+    a list of (pdga_number, name) tuples where non pdga players have the pdga number 0.
+    """
+    date = datetime.date(2025,3,1) + datetime.timedelta(days=7*event_id)
+    page = ['<html><head><title>Synthetic Event {} | Professional Disc Golf Association</title></head><body>'.format(event_id),
+            '<div class="pane-tournament-event-info"><div class="pane-content"><h4>PDGA B-tier</h4>',
+            '<div class="event-info"><div class="tournament-date">Date: {} to {}</div>'.format(
+                date.strftime('%d-%b'),(date + datetime.timedelta(days=1)).strftime('%d-%b-%Y')),
+            '<div class="tournament-location">Location: Bern, Bern, Switzerland</div>',
+            '<div class="tournament-director">Tournament Director: Synthetic Director</div></div></div></div>',
+            '<table class="summary"><tr class="odd"><td class="players">{}</td><td class="purse">$1,000</td></tr></table>'.format(len(players)),
+            '<div class="leaderboard">']
+    players = list(players)
+    rng.shuffle(players)
+    start = 0
+    for division, share in DIVISIONS.items():
+        division_players = players[start:start + max(1,int(round(share*len(players))))]
+        start += len(division_players)
+        page.append('<details><summary><h3 class="division">{} · Division ({})</h3></summary><table><tbody>'.format(division,len(division_players)))
+        scores = sorted(rng.randint(100,160) for _ in division_players)
+        place = 0
+        for idx, ((pdga_number, name), score) in enumerate(zip(division_players,scores)):
+            # players with the same score share the place
+            if idx == 0 or score != scores[idx-1]:
+                place = idx + 1
+            total = 'DNF' if rng.random() < 0.03 else str(score)
+            page.append('<tr class="{}"><td class="place">{}</td><td class="player"><a>{}</a></td><td class="pdga-number">{}</td>'
+                        '<td class="player-rating">{}</td><td class="round">{}</td><td class="round-rating">{}</td>'
+                        '<td class="round">{}</td><td class="round-rating">{}</td><td class="total">{}</td><td class="prize">{}</td></tr>'.format(
+                            'odd' if idx % 2 == 0 else 'even',place,name,pdga_number or '',rng.randint(800,1000),
+                            score//2,rng.randint(800,1000),score - score//2,rng.randint(800,1000),total,'$50' if place <= 3 else ''))
+        page.append('</tbody></table></details>')
+    page.append('</div></body></html>')
+    return ''.join(page).encode()
+
+def synthetic_player_page(pdga_number:int,name:str,rng:random.Random) -> bytes:
+    """
+    Create the html of a player details page with the structure of the pdga player pages.
+    """
+    return ('<html><body><div class="pane-page-title"><h1>{} #{}</h1></div><ul class="player-info">'
+            '<li class="location">Location: <a href="/players?City=Bern">Bern, Bern, Switzerland</a></li>'
+            '<li class="classification">Classification: Amateur</li>'
+            '<li class="join-date">Member Since: {}</li>'
+            '<li class="membership-status">Membership Status: Current (until 31-Dec-2025)</li>'
+            '<li class="official">Official Status: Certified (until 31-Dec-2025)</li>'
+            '<li class="current-rating">Current Rating: {} (as of 10-Jun-2025)</li>'
+            '<li class="career-events">Career Events: {}</li>'
+            '<li class="career-wins">Career Wins: {}</li>'
+            '<li class="career-earnings">Career Earnings: ${:,}</li>'
+            '</ul></body></html>').format(name,pdga_number,rng.randint(2000,2024),rng.randint(800,1000),
+                                          rng.randint(1,200),rng.randint(0,20),rng.randint(0,5000)).encode()
+
+def write_synthetic_fixtures(directory:str,sizes:list=[50,150,400],seed:int=0) -> list:
+    """
+    Save synthetic event pages with the given numbers of players as fixtures, for a parse benchmark without recorded pages.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for event_id, size in enumerate(sizes, start=1):
+        players = [(FIRST_PDGA_NUMBER + n, 'First{} Last{}'.format(n,n)) for n in range(size)]
+        path = os.path.join(directory,'synthetic_{}_players.html'.format(size))
+        with open(path,'wb') as f:
+            f.write(synthetic_event_page(event_id,players,rng))
+        paths.append(path)
+    return paths
+
+def create_synthetic_season(directory:str,no_events:int=20,no_players:int=500,seed:int=0) -> dict:
+    """
+    Create a synthetic season: the event and player pages are stored in a response cache in the directory
+    and the SDA excel table is saved as a local file. Each event has no_players players out of a pool of
+    players, 5% of them without a pdga number and two thirds of them with an SDA license.
+    Return the event order and points of the season and the path of the SDA table.
+    """
+    rng = random.Random(seed)
+    pool = []
+    for idx in range(int(no_players*1.5)):
+        if rng.random() < 0.05:
+            pool.append((0,'Guest{} Player{}'.format(idx,idx)))
+        else:
+            pool.append((FIRST_PDGA_NUMBER + idx,'First{} Last{}'.format(idx,idx)))
+
+    # store the pages in the response cache used by dbscrape
+    dbscrape.CACHE_DIR = os.path.join(directory,'cache')
+    event_order_and_pts = {}
+    for event_id in range(1,no_events + 1):
+        event_order_and_pts[event_id] = [rng.choice([100,100,100,200,250]),'Event {}'.format(event_id)]
+        page = synthetic_event_page(event_id,rng.sample(pool,min(no_players,len(pool))),rng)
+        write_cache('https://www.pdga.com/tour/event/' + str(event_id),page,{'fetched_at': time.time()})
+    for pdga_number, name in pool:
+        if pdga_number:
+            page = synthetic_player_page(pdga_number,name,rng)
+            write_cache('https://www.pdga.com/player/' + str(pdga_number) + '/details',page,{'fetched_at': time.time()})
+
+    # save the sda excel table
+    licensed = [player for player in pool if rng.random() < 2/3]
+    sda_info = pd.DataFrame({'Vorname': [name.split()[0] for _, name in licensed],
+                             'Name': [name.split()[1] for _, name in licensed],
+                             'PDGA': [pdga_number or None for pdga_number, _ in licensed],
+                             'SDA': ['SDA{}'.format(idx) for idx in range(len(licensed))]})
+    sda_path = os.path.join(directory,'sda.xlsx')
+    sda_info.to_excel(sda_path,index=False)
+    return {'event_order_and_pts': event_order_and_pts, 'sda_path': sda_path}
+
+# measurements
+def measure_stage(results:list,stage:str,function,*args,**kwargs):
+    """
+    Run one stage of the pipeline with its printed output suppressed.
+    Record its wall time, number of sql statements and peak memory in results.
+    """
+    tracemalloc.reset_peak()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with dbmetrics.stage(stage):
+            function(*args,**kwargs)
+    metrics = dbmetrics.get_stages()[-1]
+    results.append({'stage': stage,
+                    'seconds': metrics['seconds'],
+                    'queries': metrics['sql_statements'],
+                    'parse_seconds': metrics['parse_seconds'],
+                    'peak_memory_mb': tracemalloc.get_traced_memory()[1]/2**20})
+
+def bench_season(no_events:int=20,no_players:int=500,ingest:str='bulk',seed:int=0) -> list:
+    """
+    Run the full standings pipeline on a synthetic season, offline and against a new sqlite database.
+    ingest selects the ingestion path: bulk, concurrent or rows.
+    Return a list of dictionaries with the wall time, number of sql statements and peak memory of each stage.
+    """
+    # imported here, so that the database is configured before the first use
+    from dbobjects import init_schema
+    from dbinteract import (populate_db_by_event, populate_db_by_event_bulk, add_sda_info,
+                            calculate_swisstour_pts, create_points_df, create_standings)
+
+    results = []
+    cache_dir, offline = dbscrape.CACHE_DIR, dbscrape.OFFLINE
+    with tempfile.TemporaryDirectory() as directory:
+        season = create_synthetic_season(directory,no_events,no_players,seed)
+        event_order_and_pts = season['event_order_and_pts']
+        set_offline(True)
+        dbconn.configure('sqlite:///' + os.path.join(directory,'bench.db'))
+        init_schema(dbconn.get_engine())
+        tracemalloc.start()
+        try:
+            measure_stage(results,'parse events',
+                          lambda: [dbscrape.pdga_event(event_id) for event_id in event_order_and_pts])
+            if ingest == 'bulk':
+                measure_stage(results,'ingest (bulk)',
+                              lambda: [populate_db_by_event_bulk(event_id) for event_id in event_order_and_pts])
+            else:
+                measure_stage(results,'ingest ({})'.format(ingest),
+                              lambda: [populate_db_by_event(event_id,concurrent=(ingest == 'concurrent')) for event_id in event_order_and_pts])
+            measure_stage(results,'add_sda_info',add_sda_info,season['sda_path'])
+            measure_stage(results,'calculate_swisstour_pts',calculate_swisstour_pts,event_order_and_pts,full=True)
+            measure_stage(results,'create_points_df',
+                          lambda: [create_points_df(division,event_order_and_pts) for division in DIVISIONS])
+            measure_stage(results,'create_standings',create_standings,event_order_and_pts)
+        finally:
+            tracemalloc.stop()
+            dbconn.configure()
+            dbscrape.CACHE_DIR = cache_dir
+            set_offline(offline)
+
+    print('Synthetic season: {} events x {} players, {} ingestion'.format(no_events,no_players,ingest))
+    print('{:<26} {:>10} {:>9} {:>10} {:>12}'.format('stage','seconds','queries','parse s','peak MB'))
+    for result in results:
+        print('{:<26} {:>10.2f} {:>9} {:>10.2f} {:>12.1f}'.format(result['stage'],result['seconds'],result['queries'],
+                                                              result['parse_seconds'],result['peak_memory_mb']))
+    return results
+
+def reference_swisstour_pts(tournaments_df:pd.DataFrame,max_pts_dict:dict) -> pd.Series:
+    """
+    Compute the swisstour points of a dataframe of tournaments row by row, like the original loop over the tournaments
+    of each event and division. It is the reference for the vectorized compute_swisstour_pts.
+    """
+    from dbinteract import SWISSTOUR_PTS
+    pts = pd.Series(0, index=tournaments_df.index)
+    for (event_id, division), group in tournaments_df.groupby(['event_id','division']):
+        pts_dict = {k: int(np.ceil(v*(max_pts_dict[event_id][0]/100))) for k, v in SWISSTOUR_PTS.items()}
+        tournament_places = list(group.place)
+        for idx, tournament in group.iterrows():
+            # check if there are ties and divide points evenly
+            ties = len([place for place in tournament_places if place == tournament.place])
+            if tournament.place in pts_dict:
+                if ties == 1:
+                    tournament_pts = pts_dict[tournament.place]
+                else:
+                    total_pts = 0
+                    for t in np.arange(ties):
+                        total_pts += pts_dict.get(tournament.place + t, min(pts_dict.values()))
+                    tournament_pts = total_pts/ties
+            else:
+                tournament_pts = min(pts_dict.values())
+            # do not give points to DNF tournaments
+            pts[idx] = int(tournament_pts) if tournament.score not in (999, 888) else 0
+    return pts
+
+def synthetic_tournaments(no_events:int=20,seed:int=0) -> tuple:
+    """
+    Create a dataframe of random tournaments with ties, DNF scores and places beyond the points table,
+    and the max points of its events.
+    """
+    rng = random.Random(seed)
+    max_pts_dict = {event_id: [rng.choice([50,75,100,150,200,250]), f'Event {event_id}'] for event_id in range(1, no_events + 1)}
+    rows = []
+    for event_id in max_pts_dict:
+        for division in DIVISIONS:
+            no_players = rng.randint(1, 60)
+            place = 1
+            while no_players > 0:
+                ties = min(rng.choice([1,1,1,1,2,2,3,5]), no_players)
+                for _ in range(ties):
+                    rows.append({'event_id': event_id, 'division': division, 'place': place,
+                                 'score': rng.choice([999,888]) if rng.random() < 0.05 else rng.randint(45,80)})
+                place += ties
+                no_players -= ties
+    return pd.DataFrame(rows), max_pts_dict
+
+def verify_points(no_events:int=20,seeds:int=10) -> bool:
+    """
+    Check that compute_swisstour_pts gives the same points as the reference loop on random seasons.
+    """
+    from dbinteract import compute_swisstour_pts
+    ok = True
+    for seed in range(seeds):
+        tournaments_df, max_pts_dict = synthetic_tournaments(no_events,seed)
+        expected = reference_swisstour_pts(tournaments_df,max_pts_dict)
+        actual = compute_swisstour_pts(tournaments_df,max_pts_dict)
+        differ = expected != actual
+        if differ.any():
+            ok = False
+            print(f'Seed {seed}: {differ.sum()} of {len(tournaments_df)} tournaments differ')
+            print(tournaments_df[differ].assign(expected=expected[differ], actual=actual[differ]).head(10).to_string())
+        else:
+            print(f'Seed {seed}: the points of {len(tournaments_df)} tournaments match')
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parsing of pdga pages and the standings pipeline.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help='download event pages as fixtures')
+    record_parser.add_argument('event_ids', type=int, nargs='+')
+    record_parser.add_argument('--dir', default='fixtures')
+    parse_parser = subparsers.add_parser('parse', help='time the parsing of saved event pages')
+    parse_parser.add_argument('paths', nargs='*', default=None, help='saved pages (default: fixtures/*.html, or synthetic pages when there are none)')
+    parse_parser.add_argument('--repeat', type=int, default=5)
+    season_parser = subparsers.add_parser('season', help='run the pipeline on synthetic seasons of increasing size')
+    season_parser.add_argument('--events', default='5,20', help='comma separated numbers of events')
+    season_parser.add_argument('--players', default='100,500', help='comma separated numbers of players per event')
+    season_parser.add_argument('--ingest', default='bulk', choices=['bulk','concurrent','rows'])
+    season_parser.add_argument('--json', help='write the results to this json file')
+    verify_parser = subparsers.add_parser('verify', help='check the vectorized points against the original loop')
+    verify_parser.add_argument('--events', type=int, default=20, help='number of events of each random season')
+    verify_parser.add_argument('--seeds', type=int, default=10, help='number of random seasons')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        for event_id in args.event_ids:
+            print('Saved {}'.format(record_event_fixture(event_id,args.dir)))
+    elif args.command == 'parse':
+        paths = args.paths or sorted(glob.glob(os.path.join('fixtures','*.html')))
+        if paths:
+            bench_parse(paths,repeat=args.repeat)
+        else:
+            # without recorded pages the parsers are timed on synthetic pages of the same structure
+            print('No fixtures found, record pages with "python dbbench.py record <event_id>". Using synthetic event pages.')
+            with tempfile.TemporaryDirectory() as directory:
+                bench_parse(write_synthetic_fixtures(directory),repeat=args.repeat)
+    elif args.command == 'verify':
+        if not verify_points(args.events,args.seeds):
+            raise SystemExit(1)
+    else:
+        report = []
+        for no_events in [int(n) for n in args.events.split(',')]:
+            for no_players in [int(n) for n in args.players.split(',')]:
+                for result in bench_season(no_events,no_players,args.ingest):
+                    report.append({'events': no_events, 'players': no_players, 'ingest': args.ingest, **result})
+        if args.json:
+            with open(args.json,'w') as f:
+                json.dump(report,f,indent=2)
@@ -1,39 +1,133 @@
 # This file defines the database connection string
 from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from dbmetrics import instrument_engine
+import contextlib
 import os
+import threading
 
 load_dotenv()
 
-database = 'hoststar'
-
-if database == 'mysql-local':
-    prefix = 'mysql+mysqlconnector'
-    DB_USER = 'root'
-    DB_PASSWORD = ''
-    DB_HOST = 'localhost'
-    DB_NAME = 'wp_swisstour_2025'
-elif database == 'postgres-local':
-    prefix = 'postgresql+psycopg2'
-    DB_USER = 'postgres'
-    DB_PASSWORD = '1234'
-    DB_HOST = 'localhost'
-    DB_NAME = 'swisstour_2025'
-elif database == 'hoststar':
-    prefix = 'mysql+mysqlconnector'
-    DB_USER = os.getenv('DB_USER')
-    DB_PASSWORD = os.getenv('DB_PASSWORD')
-    DB_HOST = os.getenv('DB_HOST')
-    DB_NAME = os.getenv('DB_NAME')
-
-# Create the database URL
-DB_URL = f'{prefix}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}' 
-
-engine = create_engine(DB_URL)
-
-try:
-    with engine.connect() as connection:
-        if database == 'hoststar':
-            print("Connected successfully via SSH tunnel!")
-except Exception as e:
-    print(f"Connection failed: {e}")
\ No newline at end of file
+# Settings for the connection pool, connections are recycled before the idle timeout of the hosted mysql server closes them
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 10))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 280))
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+_db_url = None
+_engine = None
+_session_factory = None
+_lock = threading.RLock()
+
+def get_database() -> str:
+    """
+    Return the name of the configured database target: hoststar, mysql-local or postgres-local.
+    """
+    return os.getenv('DB_TARGET', 'hoststar')
+
+def get_db_url() -> str:
+    """
+    Return the database URL. It is the URL passed to configure, the DB_URL environment variable,
+    or the URL of the database target selected with the DB_TARGET environment variable.
+    """
+    if _db_url:
+        return _db_url
+    if os.getenv('DB_URL'):
+        return os.getenv('DB_URL')
+
+    database = get_database()
+    if database == 'mysql-local':
+        prefix = 'mysql+mysqlconnector'
+        DB_USER = 'root'
+        DB_PASSWORD = ''
+        DB_HOST = 'localhost'
+        DB_NAME = 'wp_swisstour_2025'
+    elif database == 'postgres-local':
+        prefix = 'postgresql+psycopg2'
+        DB_USER = 'postgres'
+        DB_PASSWORD = '1234'
+        DB_HOST = 'localhost'
+        DB_NAME = 'swisstour_2025'
+    elif database == 'hoststar':
+        prefix = 'mysql+mysqlconnector'
+        DB_USER = os.getenv('DB_USER')
+        DB_PASSWORD = os.getenv('DB_PASSWORD')
+        DB_HOST = os.getenv('DB_HOST')
+        DB_NAME = os.getenv('DB_NAME')
+    else:
+        raise ValueError(f'Unknown database target: {database}')
+
+    # Create the database URL
+    return f'{prefix}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
+
+def configure(db_url:str=None):
+    """
+    Select the database by URL (None returns to the environment configuration).
+    The shared engine is disposed and created again on next use.
+    """
+    global _db_url, _engine, _session_factory
+    with _lock:
+        if _engine is not None:
+            _engine.dispose()
+        _db_url = db_url
+        _engine = None
+        _session_factory = None
+
+def get_engine():
+    """
+    Return the engine shared by the whole process, it is created on first use.
+    Creating the engine does not connect, the first connection is opened by the first query.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            db_url = get_db_url()
+            if db_url.startswith('sqlite'):
+                # sqlite manages its own connections
+                _engine = create_engine(db_url)
+            else:
+                _engine = create_engine(db_url,
+                                        pool_size=POOL_SIZE,
+                                        max_overflow=POOL_MAX_OVERFLOW,
+                                        pool_recycle=POOL_RECYCLE,
+                                        pool_pre_ping=POOL_PRE_PING)
+            instrument_engine(_engine)
+    return _engine
+
+@contextlib.contextmanager
+def use_engine(engine):
+    """
+    Route get_engine and get_session to another engine within the block, e.g. to a local snapshot of the database.
+    """
+    global _engine, _session_factory
+    instrument_engine(engine)
+    with _lock:
+        previous = _engine, _session_factory
+        _engine, _session_factory = engine, sessionmaker(bind=engine)
+    try:
+        yield engine
+    finally:
+        with _lock:
+            _engine, _session_factory = previous
+
+def get_session():
+    """
+    Return a new session from the session factory shared by the whole process.
+    """
+    global _session_factory
+    with _lock:
+        if _session_factory is None:
+            _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory()
+
+def check_connection():
+    """
+    Test the connection to the database.
+    """
+    try:
+        with get_engine().connect() as connection:
+            if get_database() == 'hoststar':
+                print("Connected successfully via SSH tunnel!")
+    except Exception as e:
+        print(f"Connection failed: {e}")
@@ -0,0 +1,136 @@
+# This file exports the standings and the tournaments of a season to columnar files for the front-end and analytics
+from dbconn import get_session
+from dbobjects import Player, Tournament, Standing, StandingEvent
+from dbmetrics import timed_stage
+from dbscrape import write_file_atomic
+import datetime
+import hashlib
+import io
+import json
+import os
+import pandas as pd
+
+# file format of the export, parquet is used when pyarrow is installed and csv is the fallback
+try:
+    import pyarrow
+    DEFAULT_FORMAT = 'parquet'
+except ImportError:
+    DEFAULT_FORMAT = 'csv'
+EXPORT_FORMAT = os.getenv('PDGA_EXPORT_FORMAT', DEFAULT_FORMAT)
+EXPORT_DIR = os.getenv('PDGA_EXPORT_DIR', 'export')
+
+# the manifest lists the exported files with their content hash and number of rows
+MANIFEST = 'manifest.json'
+
+def season_frames(season:int,event_order_and_pts:dict) -> dict:
+    """
+    Load the standings, the points of the standings per event and the tournaments of a season.
+    Returns a dictionary of dataframes keyed by (dataset, division).
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        standings = session.query(Standing.standing_division,
+                                  Standing.standing_place,
+                                  Standing.player_id,
+                                  Player.player_pdga_id,
+                                  Player.player_firstname,
+                                  Player.player_lastname,
+                                  Standing.standing_total).join(
+                                      Player, Standing.player_id == Player.player_id).filter(
+                                          Standing.standing_season == season).order_by(
+                                              Standing.standing_division, Standing.standing_place, Standing.player_id).all()
+        standing_events = session.query(Standing.standing_division,
+                                        Standing.player_id,
+                                        StandingEvent.event_id,
+                                        StandingEvent.standing_event_points,
+                                        StandingEvent.standing_event_counted).join(
+                                            Standing, StandingEvent.standing_id == Standing.standing_id).filter(
+                                                Standing.standing_season == season).order_by(
+                                                    Standing.standing_division, Standing.player_id, StandingEvent.event_id).all()
+        tournaments = session.query(Tournament.tournament_division,
+                                    Tournament.event_id,
+                                    Tournament.player_id,
+                                    Player.player_pdga_id,
+                                    Player.player_firstname,
+                                    Player.player_lastname,
+                                    Tournament.tournament_place,
+                                    Tournament.tournament_score,
+                                    Tournament.tournament_rating,
+                                    Tournament.tournament_prize,
+                                    Tournament.tournament_propagator,
+                                    Tournament.tournament_swisstour_points).join(
+                                        Player, Tournament.player_id == Player.player_id).filter(
+                                            Tournament.event_id.in_(list(event_order_and_pts))).order_by(
+                                                Tournament.tournament_division, Tournament.event_id, Tournament.tournament_place,
+                                                Tournament.player_id).all()
+
+    datasets = {
+        'standings': pd.DataFrame(standings, columns=['division','place','player_id','pdga_number','firstname','lastname','total']),
+        'standing_events': pd.DataFrame(standing_events, columns=['division','player_id','event_id','points','counted']),
+        'tournaments': pd.DataFrame(tournaments, columns=['division','event_id','player_id','pdga_number','firstname','lastname',
+                                                          'place','score','rating','prize','propagator','points'])}
+    # integer columns keep their type when they have missing values, e.g. non pdga players
+    for df in datasets.values():
+        for column in ['place','pdga_number','total','points','score','rating']:
+            if column in df:
+                df[column] = df[column].astype('Int64')
+    event_names = {event_id: name for event_id, (max_pts, name) in event_order_and_pts.items()}
+    for dataset in ['standing_events','tournaments']:
+        datasets[dataset].insert(datasets[dataset].columns.get_loc('event_id') + 1, 'event_name',
+                                 datasets[dataset].event_id.map(event_names))
+    frames = {}
+    for dataset, df in datasets.items():
+        for division, division_df in df.groupby('division', sort=True):
+            frames[(dataset, division)] = division_df.drop(columns=['division']).reset_index(drop=True)
+    return frames
+
+def frame_hash(df:pd.DataFrame) -> str:
+    """
+    Hash the columns and rows of a dataframe.
+    """
+    digest = hashlib.sha256(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df,index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def frame_bytes(df:pd.DataFrame,file_format:str) -> bytes:
+    """
+    Serialize a dataframe to parquet or csv.
+    """
+    if file_format == 'parquet':
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    if file_format == 'csv':
+        return df.to_csv(index=False).encode()
+    raise ValueError(f'Unknown export format: {file_format}')
+
+def read_manifest(directory:str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@timed_stage('export','season')
+def export_season(season:int,event_order_and_pts:dict,directory:str=EXPORT_DIR,file_format:str=None) -> int:
+    """
+    Export the standings, the points of the standings per event and the tournaments of a season, partitioned into
+    one file per dataset, season and division: <directory>/<dataset>/season=<season>/division=<division>/part-0.parquet.
+    Files are only written when their content changed since the last export. Returns the number of files written.
+    """
+    file_format = file_format or EXPORT_FORMAT
+    manifest = read_manifest(directory)
+    written = 0
+    for (dataset, division), df in season_frames(season, event_order_and_pts).items():
+        path = os.path.join(dataset, f'season={season}', f'division={division}', f'part-0.{file_format}')
+        content_hash = frame_hash(df)
+        if manifest.get(path, {}).get('hash') == content_hash and os.path.exists(os.path.join(directory, path)):
+            continue
+        os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok=True)
+        write_file_atomic(os.path.join(directory, path), frame_bytes(df, file_format))
+        manifest[path] = {'hash': content_hash, 'rows': len(df), 'exported_at': datetime.datetime.now().isoformat(timespec='seconds')}
+        written += 1
+    if written:
+        write_file_atomic(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    print(f'Exported {written} changed files of season {season} to {directory}.')
+    return written
@@ -1,151 +1,402 @@
-from sqlalchemy import create_engine, NullPool, and_, MetaData, Table, Column, Integer, String
-from sqlalchemy.orm import sessionmaker, declarative_base
-from dbconn import DB_URL
-from dbobjects import Event, Player, Tournament
-from dbscrape import pdga_event, pdga_player
+from sqlalchemy import func, or_, tuple_, select, insert, update, delete, inspect, text, MetaData, Table, Column, Integer, String
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from dbconn import get_engine, get_session
+from dbobjects import Event, Player, Tournament, PointsState, SyncState, Standing, StandingEvent
+from dbmetrics import timed_stage
+from dbscrape import pdga_event, pdga_player, pdga_players, TournamentResult, MAX_WORKERS
 import requests
 import pandas as pd
 import io
 import numpy as np
+import datetime
+import hashlib
+import uuid
+
+# google sheet with the sda licenses
+SDA_URL = 'https://docs.google.com/spreadsheets/d/1oRw8G3JxLCsm8LjYfpfz8UXCcbRrk0zy/export?format=xlsx&ouid=110597889716666012884&rtpof=true&sd=true'
+
+# number of rows written per statement by the bulk ingestion
+BATCH_SIZE = 500
+
+# points for each place at an event with 100 max points, scaled to the max points of each event
+SWISSTOUR_PTS = {
+    1: 100, 2: 90, 3: 81, 4: 73, 5: 66,
+    6: 60, 7: 55, 8: 50, 9: 46, 10: 42,
+    11: 38, 12: 35, 13: 32, 14: 29, 15: 26,
+    16: 23, 17: 21, 18: 19, 19: 17, 20: 15,
+    21: 13, 22: 11, 23: 10, 24: 9, 25: 8,
+    26: 7, 27: 6, 28: 5,
+}
+
+# number of best results of a player that count for the standings (new in 2025 - use top 7 results)
+TOP_N_RESULTS = 7
 
 # helper functions
-def add_event(event_id:int):
+def event_from_data(event_id:int,event_data:dict) -> Event:
+    """
+    Create an event object from the scraped pdga event data.
+    """
+    return Event(
+        event_id=event_id,
+        event_name=event_data['name'],
+        event_tier=event_data['tier'],
+        event_date=event_data['date'],
+        event_days=event_data['days'],
+        event_city=event_data['city'],
+        event_state=event_data['state'],
+        event_country=event_data['country'],
+        event_no_players=event_data['players'],
+        event_purse=event_data['purse'] 
+    )
+
+def split_name(name:str):
+    """
+    Split a leaderboard name into the first and last name stored for non pdga players.
+    """
+    return name.split()[0], name.split()[1]
+
+def normalize_name(name:str) -> str:
+    """
+    Normalize a player's name for comparisons: single spaces and lower case.
+    """
+    return ' '.join(name.split()).lower()
+
+def load_ingestion_index(session) -> dict:
+    """
+    Load the keys of the existing events, players and tournaments with narrow column-only queries.
+    The index is held in sets and dictionaries and is updated by the add functions as rows are inserted.
+    """
+    index = {
+        'event_ids': set(n[0] for n in session.query(Event.event_id)),
+        'player_ids_by_pdga': {},
+        'player_ids_by_name': {},
+        'tournaments': set((n[0],n[1]) for n in session.query(Tournament.player_id,Tournament.event_id))
+    }
+    for player_id, pdga_id, firstname, lastname in session.query(
+            Player.player_id,Player.player_pdga_id,Player.player_firstname,Player.player_lastname).order_by(Player.player_id):
+        if pdga_id:
+            index['player_ids_by_pdga'].setdefault(pdga_id,player_id)
+        index['player_ids_by_name'].setdefault(normalize_name(firstname + ' ' + lastname),player_id)
+    return index
+
+def index_player(index:dict,player:Player):
+    """
+    Register a newly inserted player in the ingestion index.
+    """
+    if player.player_pdga_id:
+        index['player_ids_by_pdga'].setdefault(int(player.player_pdga_id),player.player_id)
+    index['player_ids_by_name'].setdefault(normalize_name(player.player_firstname + ' ' + player.player_lastname),player.player_id)
+
+def add_event(event_id:int,index:dict=None):
     """
     Add an event to the database given the pdga number as event_id.
-    Return the event data as a dictionary and the tournament data as a dataframe.
+    Return the event data as a dictionary and a generator of the tournament results.
     """
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
+    # open a session on the shared database engine
+    with get_session() as session:
+        if index is None:
+            index = load_ingestion_index(session)
         # check to see if event is already in the databases
-        db_events = session.query(Event).all()
-        db_event_ids = [n.event_id for n in db_events]
-        
-        if event_id not in db_event_ids:
-            event_data, tournament_df = pdga_event(event_id,event_only=False)
-            new_event = Event(
-                event_id=event_id,
-                event_name=event_data['name'],
-                event_tier=event_data['tier'],
-                event_date=event_data['date'],
-                event_days=event_data['days'],
-                event_city=event_data['city'],
-                event_state=event_data['state'],
-                event_country=event_data['country'],
-                event_no_players=event_data['players'],
-                event_purse=event_data['purse'] 
-            )
+        if event_id not in index['event_ids']:
+            event_data, results = pdga_event(event_id,event_only=False,as_frame=False)
+            new_event = event_from_data(event_id,event_data)
             session.add(new_event)
             session.commit()
+            index['event_ids'].add(event_id)
         else:
             event_data = None
-            tournament_df = None
+            results = None
             print('Event {} is already in the database.'.format(str(event_id)))
 
-    return event_data, tournament_df
+    return event_data, results
+
+def tournament_row(event_id:int,player_id:int,result:TournamentResult) -> dict:
+    """
+    Map a tournament result of a player to the columns of the tournaments table.
+    """
+    return {
+        'player_id': player_id,
+        'event_id': event_id,
+        'tournament_division': result.division,
+        'tournament_score': int(result.total),
+        'tournament_place': int(result.place),
+        'tournament_rating': int(result.rating),
+        'tournament_prize': int(result.prize),
+        'tournament_propagator': bool(result.propagator)
+    }
 
-def add_tournament(event_id:int,pdga_id:int,tournament_df=None,player_name=None):
+def add_tournament(event_id:int,result:TournamentResult,index:dict=None):
     """
-    Add a tournament to the database given the event_id and pdga number (or player's name) as pdga_id.
+    Add a tournament to the database given the event_id and the tournament result of a player.
     """
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
+    # open a session on the shared database engine
+    with get_session() as session:
+        if index is None:
+            index = load_ingestion_index(session)
         # if the player has a pdga number, use that to get the player_id, otherwise use the player name
-        if pdga_id:
+        if result.pdga_number:
             # get the player_id based on the pdga number
-            player_id = session.query(Player).filter(Player.player_pdga_id == pdga_id).all()[0].player_id
+            player_id = index['player_ids_by_pdga'][int(result.pdga_number)]
         else:
             # get the player_id based on the player name
-            player_id = session.query(Player).filter(and_(Player.player_firstname == player_name.split()[0], 
-                Player.player_lastname == player_name.split()[1])).first().player_id
+            player_id = index['player_ids_by_name'][normalize_name(' '.join(split_name(result.name)))]
             
         # check to see if the tournament is already in the database
-        db_tournaments = session.query(Tournament).all()
-        db_tournament_ids = [[n.player_id,n.event_id] for n in db_tournaments]
-        if [player_id,event_id] not in db_tournament_ids:    
-            # filter the tournament information for the individual player
-            if pdga_id:
-                tournament = tournament_df[tournament_df.pdga_number == pdga_id]
-            else:
-                tournament = tournament_df[tournament_df.name == player_name]
-            new_tournament = Tournament(
-                player_id=player_id,
-                event_id=event_id,
-                tournament_division=tournament.division.values[0],
-                tournament_score=int(tournament.total.values[0]),
-                tournament_place=int(tournament.place.values[0]),
-                tournament_rating=int(tournament.rating.values[0]),
-                tournament_prize=int(tournament.prize.values[0]),
-                tournament_propagator=int(tournament.propagator.values[0])
-            )
+        if (player_id,event_id) not in index['tournaments']:    
+            new_tournament = Tournament(**tournament_row(event_id,player_id,result))
             session.add(new_tournament)
             session.commit()
+            index['tournaments'].add((player_id,event_id))
         else:
             print('Player {} already has a tournament for event {} in the database.'.format(str(player_id),str(event_id)))
 
-def add_player(pdga_id:int):
+def column_value(column,value):
+    """
+    Convert a scraped value to the python type of its column, like it is read back from the database.
+    """
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime.datetime and isinstance(value,str):
+        # e.g. the fallback expiry of a date that could not be parsed
+        return datetime.datetime.fromisoformat(value)
+    if python_type in (int,float) and not isinstance(value,python_type):
+        return python_type(value)
+    return value
+
+def player_row(player_data:dict) -> dict:
+    """
+    Map the scraped pdga player data to the columns of the players table, with the types of the columns.
+    """
+    row = {
+        'player_pdga_id': player_data['pdga_number'],
+        'player_firstname': player_data['firstname'],
+        'player_lastname': player_data['lastname'],
+        'player_city': player_data['city'],
+        'player_state': player_data['state'],
+        'player_country': player_data['country'],
+        'player_classification': player_data['classification'],
+        'player_pdga_since': player_data['member_since'],
+        'player_pdga_status': player_data['membership_status'],
+        'player_pdga_expiry': player_data['membership_expiry'],
+        'player_official_status': player_data['official_status'],
+        'player_official_expiry': player_data['official_expiry'],
+        'player_rating': player_data['current_rating'],
+        'player_no_events': player_data['career_events'],
+        'player_no_wins': player_data['career_wins'],
+        'player_earnings': player_data['career_earnings'],
+        'player_scraped_at': datetime.datetime.now()
+    }
+    return {column: column_value(Player.__table__.columns[column],value) for column, value in row.items()}
+
+def player_from_data(player_data:dict) -> Player:
+    """
+    Create a player object from the scraped pdga player data.
+    """
+    return Player(**player_row(player_data))
+
+def add_player(pdga_id:int,index:dict=None):
     """
     Add a player to the database given the pdga number as pdga_id.
     """
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
+    # open a session on the shared database engine
+    with get_session() as session:
+        if index is None:
+            index = load_ingestion_index(session)
         # check to see if player is already in database
-        db_players = session.query(Player).all()
-        db_pdga_ids = [n.player_pdga_id for n in db_players]
-        if pdga_id not in db_pdga_ids:
+        if int(pdga_id) not in index['player_ids_by_pdga']:
             player_data = pdga_player(pdga_id)
             if player_data:
-                new_player = Player(
-                    player_pdga_id=player_data['pdga_number'],
-                    player_firstname=player_data['firstname'],
-                    player_lastname=player_data['lastname'],
-                    player_city=player_data['city'],
-                    player_state=player_data['state'], 
-                    player_country=player_data['country'],
-                    player_classification=player_data['classification'],
-                    player_pdga_since=player_data['member_since'],
-                    player_pdga_status=player_data['membership_status'],
-                    player_pdga_expiry=player_data['membership_expiry'],
-                    player_official_status=player_data['official_status'],
-                    player_official_expiry=player_data['official_expiry'],
-                    player_rating=player_data['current_rating'],
-                    player_no_events=player_data['career_events'],
-                    player_no_wins=player_data['career_wins'],
-                    player_earnings=player_data['career_earnings']
-                )
+                new_player = player_from_data(player_data)
                 session.add(new_player)
+                # index the player before the commit expires its attributes, which would reload it
+                session.flush()
+                index_player(index,new_player)
                 session.commit()
         else:
             print('Player {} is already in the database'.format(str(pdga_id)))
-        session.close()
 
-def add_non_pdga_player(name:str):
+def add_players(pdga_ids:list,max_workers:int=MAX_WORKERS,index:dict=None):
+    """
+    Add several players to the database given their pdga numbers as pdga_ids.
+    The missing players are scraped concurrently and then written in one commit.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        if index is None:
+            index = load_ingestion_index(session)
+        # check which players are already in the database
+        missing_pdga_ids = sorted(set(int(n) for n in pdga_ids if n) - set(index['player_ids_by_pdga']))
+        if not missing_pdga_ids:
+            return
+        players_data = pdga_players(missing_pdga_ids,max_workers=max_workers)
+        # write the players in the same order as they were requested
+        new_players = [player_from_data(players_data[n]) for n in missing_pdga_ids if n in players_data]
+        session.add_all(new_players)
+        # index the players before the commit expires their attributes, which would reload each of them
+        session.flush()
+        for new_player in new_players:
+            index_player(index,new_player)
+        session.commit()
+        print('Added {} of {} missing players to the database.'.format(len(players_data),len(missing_pdga_ids)))
 
+def add_non_pdga_player(name:str,index:dict=None):
     """
     Add a non pdga player to the database given the player's name.
     """
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
+    # open a session on the shared database engine
+    with get_session() as session:
+        if index is None:
+            index = load_ingestion_index(session)
         # check to see if player is already in database
-        db_players = session.query(Player).all()
-        db_names = [(n.player_firstname + ' ' + n.player_lastname) for n in db_players]
-        if name not in db_names:
+        firstname, lastname = split_name(name)
+        if normalize_name(firstname + ' ' + lastname) not in index['player_ids_by_name']:
             new_player = Player(
-                player_firstname=name.split()[0],
-                player_lastname=name.split()[1]
+                player_firstname=firstname,
+                player_lastname=lastname
             )
             session.add(new_player)
+            # index the player before the commit expires its attributes, which would reload it
+            session.flush()
+            index_player(index,new_player)
             session.commit()
         else:
             print('Player {} is already in the database'.format(name))
 
+def upsert_rows(session,model,rows:list,index_elements:list,update_columns:list):
+    """
+    Write rows to the table of the model in batches with the upsert statement of the database dialect.
+    Rows that conflict on index_elements get their update_columns overwritten.
+    """
+    table = model.__table__
+    dialect = session.bind.dialect.name
+    # rows within one multi-row statement need the same columns
+    rows_by_columns = {}
+    for row in rows:
+        rows_by_columns.setdefault(tuple(sorted(row)),[]).append(row)
+    for same_column_rows in rows_by_columns.values():
+        for start in range(0,len(same_column_rows),BATCH_SIZE):
+            batch = same_column_rows[start:start+BATCH_SIZE]
+            if dialect == 'mysql':
+                stmt = mysql.insert(table).values(batch)
+                stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+            elif dialect in ('postgresql','sqlite'):
+                stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table).values(batch)
+                stmt = stmt.on_conflict_do_update(index_elements=index_elements,
+                                                  set_={c: stmt.excluded[c] for c in update_columns})
+            else:
+                raise NotImplementedError('Upserts are not supported for the {} dialect.'.format(dialect))
+            session.execute(stmt)
+
+def resolve_player_ids(session,pdga_ids:list,names:list):
+    """
+    Look up the player_ids for pdga numbers and (for non pdga players) names in one query.
+    Return a dictionary keyed by pdga number and a dictionary keyed by (firstname, lastname).
+    """
+    conditions = []
+    if pdga_ids:
+        conditions.append(Player.player_pdga_id.in_(pdga_ids))
+    if names:
+        conditions.append(tuple_(Player.player_firstname,Player.player_lastname).in_(names))
+    ids_by_pdga, ids_by_name = {}, {}
+    if conditions:
+        for player_id, pdga_id, firstname, lastname in session.query(
+                Player.player_id,Player.player_pdga_id,Player.player_firstname,Player.player_lastname).filter(
+                    or_(*conditions)).order_by(Player.player_id):
+            if pdga_id:
+                ids_by_pdga.setdefault(pdga_id,player_id)
+            ids_by_name.setdefault((firstname,lastname),player_id)
+    return ids_by_pdga, ids_by_name
+
+def add_event_results_bulk(session,event_id:int,results,max_workers:int=MAX_WORKERS,players_data:dict=None):
+    """
+    Add the players and tournaments of a whole event leaderboard (tournament results) in batches, without committing.
+    Missing pdga players are taken from players_data (scraped player data keyed by pdga number) or scraped concurrently,
+    existing tournaments get their results updated. Raises a RuntimeError when a player cannot be scraped,
+    so that the caller rolls back and the event is ingested again by the next run.
+    """
+    players_data = players_data or {}
+    results = list(results)
+    pdga_ids = sorted(set(int(n.pdga_number) for n in results if n.pdga_number))
+    names = sorted(set(split_name(n.name) for n in results if not n.pdga_number))
+    ids_by_pdga, ids_by_name = resolve_player_ids(session,pdga_ids,names)
+
+    # insert the missing players
+    missing_pdga_ids = [n for n in pdga_ids if n not in ids_by_pdga]
+    missing_names = [n for n in names if n not in ids_by_name]
+    new_players = []
+    if missing_pdga_ids:
+        players_data = {**pdga_players([n for n in missing_pdga_ids if n not in players_data],max_workers=max_workers),
+                        **players_data}
+        # a result without its player would be lost for good once the event is committed, so nothing is written
+        not_scraped = [n for n in missing_pdga_ids if n not in players_data]
+        if not_scraped:
+            raise RuntimeError('Event {} was not written, the players {} could not be scraped.'.format(
+                event_id,', '.join(str(n) for n in not_scraped)))
+        new_players += [player_row(players_data[n]) for n in missing_pdga_ids]
+    new_players += [{'player_firstname': firstname, 'player_lastname': lastname} for firstname, lastname in missing_names]
+    for start in range(0,len(new_players),BATCH_SIZE):
+        session.execute(insert(Player),new_players[start:start+BATCH_SIZE])
+    if new_players:
+        ids_by_pdga, ids_by_name = resolve_player_ids(session,pdga_ids,names)
+        print('Added {} players to the database.'.format(len(new_players)))
+
+    # existing tournaments conflict on the unique (player_id, event_id) index and get their results updated
+    tournament_rows = {}
+    for result in results:
+        if result.pdga_number:
+            player_id = ids_by_pdga.get(int(result.pdga_number))
+        else:
+            player_id = ids_by_name.get(split_name(result.name))
+        if player_id is None:
+            raise RuntimeError('Event {} was not written, the player {} is not in the database.'.format(event_id,result.name))
+        if player_id in tournament_rows:
+            continue
+        tournament_rows[player_id] = tournament_row(event_id,player_id,result)
+    upsert_rows(session,Tournament,list(tournament_rows.values()),['player_id','event_id'],
+                ['tournament_division','tournament_score','tournament_place','tournament_rating',
+                 'tournament_prize','tournament_propagator'])
+    print('Wrote {} tournaments for event {} to the database.'.format(len(tournament_rows),event_id))
+
+def scaled_pts_dict(max_pts:int) -> dict:
+    """
+    Scale the points for each place to the max points of an event.
+    """
+    return {k: int(np.ceil(v*(max_pts/100))) for k, v in SWISSTOUR_PTS.items()}
+
+def compute_swisstour_pts(tournaments_df:pd.DataFrame,max_pts_dict:dict) -> pd.Series:
+    """
+    Compute the swisstour points for a dataframe of tournaments with the columns event_id, division, place and score.
+    Tied players share the points of the places they occupy evenly, places without points get the minimum points
+    and DNF tournaments (score 999 or 888) get no points.
+    """
+    places = tournaments_df['place'].to_numpy(dtype=np.int64)
+    # count the players on the same place in the same event and division
+    ties = tournaments_df.groupby(['event_id','division','place'],dropna=False)['place'].transform('size').to_numpy(dtype=np.int64)
+    pts = np.zeros(len(tournaments_df))
+    for event_id, positions in tournaments_df.groupby('event_id').indices.items():
+        pts[positions] = shared_place_pts(places[positions],ties[positions],max_pts_dict[event_id][0])
+    # do not give points to DNF tournaments
+    dnf = tournaments_df['score'].isin([999,888]).to_numpy()
+    return pd.Series(np.where(dnf, 0, np.trunc(pts)).astype(int), index=tournaments_df.index)
+
+def shared_place_pts(places:np.ndarray,ties:np.ndarray,max_pts:int) -> np.ndarray:
+    """
+    Compute the points for arrays of places and the number of players tied on each place at an event with max_pts.
+    Tied players share the points of the places they occupy evenly, places without points get the minimum points.
+    """
+    pts_dict = scaled_pts_dict(max_pts)
+    min_pts = min(pts_dict.values())
+    # points for every place that a group of tied players can occupy
+    table = np.full(max(places.max() + ties.max(), max(pts_dict)) + 1, min_pts, dtype=float)
+    table[list(pts_dict)] = list(pts_dict.values())
+    cumulative = np.concatenate(([0.0], np.cumsum(table)))
+    # sum of the points of the places place, ..., place+ties-1 divided by the number of ties
+    first = np.clip(places, 0, None)
+    shared_pts = (cumulative[first + ties] - cumulative[first])/ties
+    in_pts_dict = (places >= min(pts_dict)) & (places <= max(pts_dict))
+    return np.where(in_pts_dict, shared_pts, min_pts)
+
 # calc_pts depreciated due to other calculation system
 def calc_pts(n:int,k:int,pts_max:int):
     '''
@@ -171,89 +422,72 @@ def calc_pts(n:int,k:int,pts_max:int):
     
     return pts
 
+def top_n_points(points:np.ndarray,n:int=TOP_N_RESULTS):
+    """
+    Sum the n best results in each row of a points matrix (players x events), NaN marks an event the player skipped.
+    Return the totals and a boolean mask of the results that are counted.
+    """
+    skipped = np.isnan(points)
+    # sort each row descending, skipped events last
+    order = np.argsort(np.where(skipped, np.inf, -points), axis=1, kind='stable')[:, :n]
+    counted = np.zeros(points.shape, dtype=bool)
+    np.put_along_axis(counted, order, True, axis=1)
+    counted &= ~skipped
+    totals = np.where(counted, points, 0).sum(axis=1)
+    return totals, counted
+
+@timed_stage('points_table','division')
 def create_points_df(division:str,max_pts_dict:dict):
     '''
     Function to extract a table of all players and their respective points.
     '''
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    session=Session()
-
-    # get all table that contains everybody with swisstour_license = True, 
-    # include columns player_id, player_firstname, player_lastname, player_swisstour_license
-    players_w_license = session.query(Player.player_id,
-                            Player.player_firstname,
-                            Player.player_lastname,
-                            Player.player_sda_id,
-                            Player.player_swisstour_license).filter(
-                                Player.player_swisstour_license == True).all()
-    # get all the event ids and names
-    events = session.query(Event).join(Tournament, Event.event_id == Tournament.event_id).filter(Tournament.tournament_division == division).all()
-    event_info = [(event.event_id,event.event_name) for event in events]
-    event_info_dict = dict(event_info)
+    # open a session on the shared database engine
+    with get_session() as session:
+        # get all the event ids and names
+        events = session.query(Event.event_id, Event.event_name).join(
+            Tournament, Event.event_id == Tournament.event_id).filter(Tournament.tournament_division == division).distinct().all()
+        # get the points of everybody with swisstour_license = True in the division with one joined query
+        results = session.query(Player.player_id,
+                                Player.player_firstname,
+                                Player.player_lastname,
+                                Player.player_sda_id,
+                                Tournament.event_id,
+                                Tournament.tournament_swisstour_points).join(
+                                    Tournament, Tournament.player_id == Player.player_id).filter(
+                                        Player.player_swisstour_license == True,
+                                        Tournament.tournament_division == division).order_by(
+                                            Player.player_id, Tournament.tournament_id).all()
+    event_info_dict = dict(events)
     # replace the event names with shortened names
     for e in event_info_dict:
         event_info_dict[e] = max_pts_dict[e][1]
 
-    session.close()
-
-    list_of_dicts = []
-    # for each player create a dictionary with results
-    for player in players_w_license:
-        # get all tournaments for the player
-        tournaments = session.query(Tournament).filter(Tournament.player_id == player.player_id).all()
-        # get all the points for the player
-        points = [(tournament.event_id, tournament.tournament_swisstour_points) 
-                  for tournament in tournaments if tournament.tournament_division == division]
-        points_dict = dict(points)
-        # create a dictionary with the player and points
-        if points_dict:
-            dict_ = {"player": player.player_firstname + ' ' + player.player_lastname,
-                    "sda_license": player.player_sda_id
-                    }
-            dict_.update(points_dict)
-            list_of_dicts.append(dict_)
-    
-    def sum_points(row, max_pts_dict:dict):
-        # events_100_list = []
-        # events_200_list = []
-        # events_250_list = []
-        # for key, value in max_pts_dict.items():
-        #     if value == 100:
-        #         events_100_list.append(key)
-        #     elif value == 200:
-        #         events_200_list.append(key)
-        #     elif value == 250:
-        #         events_250_list.append(key)
-
-        # events_100_pts = row[row.index.isin(events_100_list)].sort_values(ascending=False).iloc[:3].sum()
-        # events_100_incl = row[row.index.isin(events_100_list)].sort_values(ascending=False).iloc[:3].index
-        # events_200_pts = row[row.index.isin(events_200_list)].sort_values(ascending=False).iloc[:2].sum()
-        # events_200_incl = row[row.index.isin(events_200_list)].sort_values(ascending=False).iloc[:2].index
-        # events_250_pts = row[row.index.isin(events_250_list)].sort_values(ascending=False).iloc[:1].sum()
-        # events_250_incl = row[row.index.isin(events_250_list)].sort_values(ascending=False).iloc[:1].index
-        # pts = events_100_pts + events_200_pts + events_250_pts
-        # events_incl = events_100_incl.values.tolist() + events_200_incl.values.tolist() + events_250_incl.values.tolist()
-
-        # new in 2025 - use top 7 results
-        pts = row[row.index.isin(max_pts_dict)].sort_values(ascending=False).iloc[:7].sum()
-        events_incl = row[row.index.isin(max_pts_dict)].sort_values(ascending=False).iloc[:7].index.values.tolist()
-
-        return pts, events_incl
+    results_df = pd.DataFrame(results, columns=['player_id','firstname','lastname','sda_license','event_id','points'])
+    if results_df.empty:
+        return pd.DataFrame()
+    # pivot to one row per player and one column of points per event
+    points = results_df.pivot_table(index='player_id', columns='event_id', values='points', aggfunc='last', dropna=False)
+    # keep the events in the order they first appear, like the rows of the players
+    points = points[results_df.event_id.unique()]
+    points.columns.name = None
+    players = results_df.drop_duplicates('player_id').set_index('player_id')
+    players = pd.DataFrame({"player": players.firstname + ' ' + players.lastname,
+                            "sda_license": players.sda_license})
     
-    # create a pandas dataframe from the list of dictionaries
-    df = pd.DataFrame(list_of_dicts)
+    # combine the players with their points
+    df = players.join(points).reset_index(drop=True)
     if not df.empty:
-        df[['Total', 'events_incl']] = df.apply(lambda row : pd.Series(sum_points(row, max_pts_dict)), axis=1)
+        # sum the best results of each player and mark the counted results
+        counted_events = [col for col in df.columns if col in max_pts_dict]
+        totals, counted = top_n_points(df[counted_events].to_numpy(dtype=float))
+        df['Total'] = totals
 
         # create indicator columns
         events = [event.event_id for event in events]
         for event in events:
-            df[f'{event}_indicator'] = df.apply(lambda row : event in row['events_incl'], axis=1)
+            df[f'{event}_indicator'] = counted[:, counted_events.index(event)] if event in counted_events else False
 
         df.rename(columns={**event_info_dict, **{f'{event}_indicator': f'{event_info_dict[event]}_indicator' for event in events}}, inplace=True)
-        df.drop(columns=['events_incl'], inplace=True)
         
         df['Place'] = df['Total'].rank(ascending=False,method='min').astype(int)
         df = df.sort_values(by='Place',ascending=True)
@@ -264,145 +498,492 @@ def create_points_df(division:str,max_pts_dict:dict):
         return pd.DataFrame()
 
 # functions
-def populate_db_by_event(event_id:int):
+@timed_stage('ingest','event_id')
+def populate_db_by_event(event_id:int,concurrent:bool=False,max_workers:int=MAX_WORKERS):
     """
     Populate the database with the event, player, and tournament information for a given event.
+    In concurrent mode the pdga players of the event are scraped in parallel before the tournaments are added.
     """
-    _, tournament_df = add_event(event_id)
+    # load the keys of the existing rows once for all duplicate checks of this event
+    with get_session() as session:
+        index = load_ingestion_index(session)
+    _, results = add_event(event_id,index=index)
     
-    if isinstance(tournament_df, pd.DataFrame):
-        for _,tournament in tournament_df.iterrows():
-            if tournament['pdga_number'] != 0:
-                add_player(tournament.pdga_number)
-                add_tournament(event_id,tournament.pdga_number,tournament_df)
+    if results is not None:
+        if concurrent:
+            # the pdga numbers of all players are needed before the results are added
+            results = list(results)
+            add_players([result.pdga_number for result in results],max_workers=max_workers,index=index)
+        for result in results:
+            if result.pdga_number != 0:
+                add_player(result.pdga_number,index=index)
             else:
-                add_non_pdga_player(tournament['name'])
-                add_tournament(event_id,tournament.pdga_number,tournament_df,player_name=tournament['name'])
+                add_non_pdga_player(result.name,index=index)
+            add_tournament(event_id,result,index=index)
+
+@timed_stage('ingest','event_id')
+def populate_db_by_event_bulk(event_id:int,max_workers:int=MAX_WORKERS):
+    """
+    Populate the database with the event, player, and tournament information for a given event
+    using batched writes and a single commit for the whole event.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        if session.get(Event,event_id) is not None:
+            print('Event {} is already in the database.'.format(str(event_id)))
+            return
+    event_data, results = pdga_event(event_id,event_only=False,as_frame=False)
+    write_event(event_id,event_data,results,max_workers=max_workers)
+
+def write_event(event_id:int,event_data:dict,results,max_workers:int=MAX_WORKERS,players_data:dict=None):
+    """
+    Write a scraped event and its leaderboard to the database in a single commit.
+    players_data holds player data that was already scraped, keyed by pdga number.
+    """
+    with get_session() as session:
+        session.add(event_from_data(event_id,event_data))
+        session.flush()
+        add_event_results_bulk(session,event_id,results,max_workers=max_workers,players_data=players_data)
+        session.commit()
+
+def fingerprint_leaderboard(results:list) -> dict:
+    """
+    Hash the leaderboard of each division of an event, so that polls of an event can skip unchanged divisions.
+    """
+    rows = {}
+    for result in results:
+        rows.setdefault(result.division,[]).append(repr((result.pdga_number,result.name,result.place,result.total,
+                                                          result.rating,result.prize,result.propagator)))
+    return {division: hashlib.sha256('\n'.join(sorted(n)).encode()).hexdigest() for division, n in rows.items()}
 
-def add_sda_info():
+def changed_results(session,event_id:int,results:list) -> tuple:
+    """
+    Compare tournament results with the tournaments of the event in the database.
+    Returns the results of players that are new or whose division, place, score, rating or prize changed,
+    and the divisions of the database that these players leave.
+    """
+    pdga_ids = sorted(set(int(n.pdga_number) for n in results if n.pdga_number))
+    names = sorted(set(split_name(n.name) for n in results if not n.pdga_number))
+    ids_by_pdga, ids_by_name = resolve_player_ids(session,pdga_ids,names)
+    columns = ['tournament_division','tournament_score','tournament_place','tournament_rating','tournament_prize','tournament_propagator']
+    db_rows = {n.player_id: n for n in session.query(Tournament.player_id,*[getattr(Tournament,c) for c in columns]).filter(
+        Tournament.event_id == event_id)}
+    changed, left_divisions = [], set()
+    for result in results:
+        player_id = ids_by_pdga.get(int(result.pdga_number)) if result.pdga_number else ids_by_name.get(split_name(result.name))
+        if player_id is None or player_id not in db_rows:
+            changed.append(result)
+            continue
+        row = tournament_row(event_id,player_id,result)
+        if any(row[c] != getattr(db_rows[player_id],c) for c in columns):
+            changed.append(result)
+            left_divisions.add(db_rows[player_id].tournament_division)
+    return changed, left_divisions
+
+@timed_stage('poll','event_id')
+def poll_event(event_id:int,max_pts_dict:dict,fingerprints:dict=None,max_workers:int=MAX_WORKERS,
+               season:int=None,wide:bool=True,sda_source:str=SDA_URL) -> dict:
+    """
+    Poll the page of an event in progress and ingest only the tournament results that changed.
+    fingerprints are the division fingerprints of the previous poll; divisions that did not change are skipped.
+    The points and standings are recalculated for the divisions with changes only, season and wide select
+    the standings that are published like for create_standings. Players that are new to the database get their
+    sda license from sda_source before the standings are created. Returns the division fingerprints of this poll.
+    When a player of a changed result cannot be scraped, nothing is written and the poll raises, so that the next
+    poll with the previous fingerprints tries the whole leaderboard again.
+    """
+    fingerprints = fingerprints or {}
+    event_data, results = pdga_event(event_id,event_only=False,as_frame=False,max_age=0)
+    results = list(results)
+    new_fingerprints = fingerprint_leaderboard(results)
+    polled_divisions = set(n for n in new_fingerprints if new_fingerprints[n] != fingerprints.get(n))
+    if not polled_divisions:
+        print('No changes in event {}.'.format(event_id))
+        return new_fingerprints
+
+    # open a session on the shared database engine
+    with get_session() as session:
+        is_new_event = session.get(Event,event_id) is None
+        max_player_id = session.query(func.max(Player.player_id)).scalar()
+    if is_new_event:
+        write_event(event_id,event_data,results,max_workers=max_workers)
+        divisions = set(new_fingerprints)
+    else:
+        with get_session() as session:
+            changed, left_divisions = changed_results(session,event_id,[n for n in results if n.division in polled_divisions])
+            if changed:
+                add_event_results_bulk(session,event_id,changed,max_workers=max_workers)
+                session.commit()
+        divisions = set(n.division for n in changed) | left_divisions
+    if not divisions:
+        print('No changed tournaments in event {}.'.format(event_id))
+        return new_fingerprints
+
+    # new players have no sda license yet and would be missing from the standings
+    with get_session() as session:
+        has_new_players = session.query(func.max(Player.player_id)).scalar() != max_player_id
+    if has_new_players:
+        add_sda_info(sda_source)
+
+    # recalculate the points of the event and the standings of the divisions with changes
+    calculate_swisstour_pts(max_pts_dict,event_ids=[event_id])
+    create_standings(max_pts_dict,divisions=sorted(divisions),season=season,wide=wide)
+    return new_fingerprints
+
+@timed_stage('sda')
+def add_sda_info(source:str=SDA_URL):
     """
     For each player in the database, add their SDA information from the
-    SDA excel table if applicable.
+    SDA excel table if applicable. The source is the url or the local path
+    of the table. The step is skipped when neither the table nor the players
+    changed since the last successful sync.
     """
-    # read the sda excel table
-    url = 'https://docs.google.com/spreadsheets/d/1oRw8G3JxLCsm8LjYfpfz8UXCcbRrk0zy/export?format=xlsx&ouid=110597889716666012884&rtpof=true&sd=true'
-    response = requests.get(url)
-    if response.status_code == 200:
+    # download or read the sda excel table
+    if source.startswith('http'):
+        response = requests.get(source)
+        if response.status_code != 200:
+            print(f'Error downloading the excel file: {response.status_code}')
+            return    
+        content = response.content
+    else:
+        with open(source,'rb') as f:
+            content = f.read()
+
+    # open a session on the shared database engine
+    with get_session() as session:
+        # new players need their SDA info even if the table did not change
+        player_count, max_player_id = session.query(func.count(Player.player_id), func.max(Player.player_id)).one()
+        content_hash = hashlib.sha256(content + f'{player_count}:{max_player_id}'.encode()).hexdigest()
+        sync_state = session.get(SyncState, 'sda')
+        if sync_state is not None and sync_state.sync_state_hash == content_hash:
+            print('SDA info is up to date.')
+            return
+
+        # read the sda excel table once
         try:
-            file = io.BytesIO(response.content)
-            df = pd.read_excel(file, engine='openpyxl')
+            sda_info = pd.read_excel(io.BytesIO(content), engine='openpyxl')
         except:
-            print(f'Error reading the excel file: {url}')
+            print(f'Error reading the excel file: {source}')
             return
-    else:
-        print(f'Error downloading the excel file: {response.status_code}')
-        return    
-    file = io.BytesIO(response.content)
-
-    sda_info = pd.read_excel(file, engine='openpyxl')
-    sda_info = sda_info.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    sda_info['PDGA'] = sda_info['PDGA'].fillna(0).astype(int)
-    sda_pdga_ids = sda_info['PDGA'].tolist()
-    sda_names = [n.Vorname + ' ' + n.Name for _,n in sda_info.iterrows()]
-
-    # create a connection to the database
-    engine=create_engine(DB_URL,poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
-        # get all players from the database
-        all_players = session.query(Player).all()
-        for player in all_players:
-            if (player.player_pdga_id != None) & (player.player_pdga_id in sda_pdga_ids): 
-                sda_player = sda_info[sda_info.PDGA == player.player_pdga_id]
-            elif (player.player_firstname + ' ' + player.player_lastname) in sda_names:
-                sda_player = sda_info[sda_info.Vorname + ' ' + sda_info.Name == player.player_firstname + ' ' + player.player_lastname]
+        sda_ids_by_pdga, sda_ids_by_name = sda_indexes(sda_info)
+
+        # compare the SDA info of all players with the table
+        players = session.query(Player.player_id,
+                                Player.player_pdga_id,
+                                Player.player_firstname,
+                                Player.player_lastname,
+                                Player.player_sda_id,
+                                Player.player_swisstour_license).all()
+        changes = []
+        for player in players:
+            name = normalize_name(player.player_firstname + ' ' + player.player_lastname)
+            if player.player_pdga_id and player.player_pdga_id in sda_ids_by_pdga:
+                sda_id, tour_license = sda_ids_by_pdga[player.player_pdga_id], True
+            elif name in sda_ids_by_name:
+                sda_id, tour_license = sda_ids_by_name[name], True
             else:
-                player.player_swisstour_license = False
-                player.player_sda_id = None
+                sda_id, tour_license = None, False
                 print(f'No SDA info available for {player.player_firstname} {player.player_lastname}.')
+            if (sda_id, tour_license) != (player.player_sda_id, player.player_swisstour_license):
+                changes.append({'player_id': player.player_id,
+                                'player_sda_id': sda_id,
+                                'player_swisstour_license': tour_license})
+
+        # write the changed players with one bulk update and remember the synced table
+        if changes:
+            session.execute(update(Player), changes)
+        if sync_state is None:
+            sync_state = SyncState(sync_state_name='sda')
+            session.add(sync_state)
+        sync_state.sync_state_hash = content_hash
+        sync_state.sync_state_synced_at = datetime.datetime.now()
+        session.commit()
+        print(f'Updated SDA info for {len(changes)} of {len(players)} players.')
+
+def sda_indexes(sda_info:pd.DataFrame):
+    """
+    Index the SDA numbers of the SDA excel table by pdga number and by normalized name.
+    The first row wins if a player is listed more than once.
+    """
+    sda_ids_by_pdga, sda_ids_by_name = {}, {}
+    columns = [sda_info[column].map(lambda x: x.strip() if isinstance(x, str) else x) for column in ['PDGA','Vorname','Name','SDA']]
+    pdga_ids = pd.to_numeric(columns[0], errors='coerce').fillna(0).astype(int)
+    for pdga_id, firstname, lastname, sda_id in zip(pdga_ids, *columns[1:]):
+        # sda numbers are stored as text
+        if pd.isna(sda_id):
+            sda_id = None
+        elif isinstance(sda_id, float) and sda_id.is_integer():
+            sda_id = str(int(sda_id))
+        else:
+            sda_id = str(sda_id)
+        if pdga_id:
+            sda_ids_by_pdga.setdefault(int(pdga_id), sda_id)
+        if isinstance(firstname, str) and isinstance(lastname, str):
+            sda_ids_by_name.setdefault(normalize_name(firstname + ' ' + lastname), sda_id)
+    return sda_ids_by_pdga, sda_ids_by_name
+
+@timed_stage('players')
+def refresh_player_profiles(max_age_days:float=7,batch_size:int=100,max_workers:int=MAX_WORKERS):
+    """
+    Scrape again the pdga profiles of the players that were last scraped more than max_age_days ago.
+    Licensed swisstour players go first, then the players with the oldest profiles. Each batch of players
+    is scraped concurrently and only the fields that changed are written, one commit per batch.
+    """
+    columns = [column for column in Player.__table__.columns.keys() if column not in ('player_pdga_id','player_scraped_at')]
+    stale_before = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    # open a session on the shared database engine
+    with get_session() as session:
+        players = session.query(Player).filter(Player.player_pdga_id.isnot(None),
+                                               or_(Player.player_scraped_at.is_(None),Player.player_scraped_at < stale_before)).all()
+        players.sort(key=lambda n: (not n.player_swisstour_license, n.player_scraped_at or datetime.datetime.min))
+        players = [{column: getattr(n,column) for column in ['player_pdga_id'] + columns} for n in players]
+        session.expunge_all()
+        print('Refreshing the profiles of {} players.'.format(len(players)))
+
+        refreshed = changed = 0
+        for start in range(0,len(players),batch_size):
+            batch = players[start:start+batch_size]
+            players_data = pdga_players([n['player_pdga_id'] for n in batch],max_workers=max_workers,
+                                        max_age=max_age_days*24*3600)
+            changes = []
+            for player in batch:
+                if player['player_pdga_id'] not in players_data:
+                    continue
+                row = player_row(players_data[player['player_pdga_id']])
+                change = {column: row[column] for column in columns if column in row and row[column] != player[column]}
+                changed += bool(change)
+                changes.append({'player_id': player['player_id'], 'player_scraped_at': row['player_scraped_at'], **change})
+            if changes:
+                session.execute(update(Player), changes)
                 session.commit()
-                continue
-            try:
-                if sda_player.SDA.empty:
-                    tour_license = False
+            refreshed += len(changes)
+        print('Refreshed {} profiles, {} of them changed.'.format(refreshed,changed))
+
+def fingerprint_divisions(tournaments_df:pd.DataFrame) -> pd.Series:
+    """
+    Fingerprint the tournaments of each (event_id, division) pair, the fingerprint changes when a
+    tournament is gained, lost, or its place or score changes.
+    """
+    row_hashes = pd.util.hash_pandas_object(tournaments_df[['tournament_id','place','score']], index=False)
+    grouped = row_hashes.groupby([tournaments_df.event_id, tournaments_df.division])
+    # the sum of the row hashes does not depend on the order of the rows
+    return grouped.sum().map(lambda h: '{:016x}'.format(int(h))) + grouped.size().map(lambda n: '-{}'.format(n))
+
+@timed_stage('points')
+def calculate_swisstour_pts(max_pts_dict:dict,full:bool=False,event_ids:list=None):
+    """
+    Calculate the swisstour points for each event in the database, or only for the given event_ids.
+    Only the (event, division) pairs whose tournaments or max points changed since the last calculation
+    are recomputed, unless full is set.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        # get all tournaments from the database in one query
+        tournaments = session.query(Tournament.tournament_id,
+                                    Tournament.event_id,
+                                    Tournament.tournament_division,
+                                    Tournament.tournament_place,
+                                    Tournament.tournament_score)
+        states = session.query(PointsState)
+        if event_ids is not None:
+            tournaments = tournaments.filter(Tournament.event_id.in_(event_ids))
+            states = states.filter(PointsState.event_id.in_(event_ids))
+        tournaments_df = pd.DataFrame(tournaments.all(), columns=['tournament_id','event_id','division','place','score'])
+        states = {(n.event_id, n.points_state_division): (n.points_state_max_pts, n.points_state_fingerprint)
+                  for n in states}
+
+        # find the (event, division) pairs that changed since the last calculation
+        fingerprints = fingerprint_divisions(tournaments_df) if not tournaments_df.empty else pd.Series(dtype=str)
+        dirty = [key for key, fingerprint in fingerprints.items()
+                 if full or states.get(key) != (max_pts_dict[key[0]][0], fingerprint)]
+        removed = [key for key in states if key not in fingerprints.index]
+        if not dirty and not removed:
+            print('Swisstour points are up to date.')
+            return
+
+        dirty_df = tournaments_df[pd.MultiIndex.from_frame(tournaments_df[['event_id','division']]).isin(dirty)].copy()
+        if not dirty_df.empty:
+            dirty_df['points'] = compute_swisstour_pts(dirty_df, max_pts_dict)
+            # write the points to the database with one bulk update
+            session.execute(update(Tournament), [
+                {'tournament_id': tournament_id, 'tournament_swisstour_points': points}
+                for tournament_id, points in zip(dirty_df.tournament_id.tolist(), dirty_df.points.tolist())])
+
+        # remember the state the points were calculated from
+        outdated = [(int(event_id), division) for event_id, division in dirty + removed if (event_id, division) in states]
+        if outdated:
+            session.query(PointsState).filter(
+                tuple_(PointsState.event_id, PointsState.points_state_division).in_(outdated)).delete(synchronize_session=False)
+        session.add_all([PointsState(event_id=int(event_id),
+                                     points_state_division=division,
+                                     points_state_max_pts=max_pts_dict[event_id][0],
+                                     points_state_fingerprint=fingerprints[(event_id, division)])
+                         for event_id, division in dirty])
+        session.commit()
+        print(f'Recomputed swisstour points for {len(dirty_df)} tournaments in {len(dirty)} of {len(fingerprints)} event divisions.')
+
+def standings_hash(points_df:pd.DataFrame) -> str:
+    """
+    Hash the columns and rows of a standings dataframe.
+    """
+    digest = hashlib.sha256(repr(list(points_df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(points_df,index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+@timed_stage('publish','division')
+def publish_standings_table(division:str,points_df:pd.DataFrame) -> bool:
+    """
+    Publish the standings table of a division. The rows are bulk loaded into a staging table,
+    which then replaces the standings table atomically, so readers never see a missing or partial table.
+    Standings that did not change since they were last published are kept, returns whether the table was replaced.
+    """
+    engine = get_engine()
+    quote = engine.dialect.identifier_preparer.quote
+    table_name = f'standings_{division}'
+    content_hash = standings_hash(points_df)
+    with get_session() as session:
+        sync_state = session.get(SyncState,table_name)
+        if sync_state is not None and sync_state.sync_state_hash == content_hash and inspect(engine).has_table(table_name):
+            print(f'Standings of {division} are up to date.')
+            return False
+    # unique names, so that constraint and sequence names of earlier staging tables never collide
+    token = uuid.uuid4().hex[:8]
+    staging_name = f'{table_name}_staging_{token}'
+    old_name = f'{table_name}_old_{token}'
+
+    # create the staging table with the same structure as the standings table
+    columns = [Column('standing_id', Integer(), primary_key=True)]
+    for column_name in points_df.columns:
+        if (column_name == 'Place'):
+            columns.append(Column(column_name, Integer()))
+        else:
+            columns.append(Column(column_name, String(100)))
+    staging_table = Table(staging_name, MetaData(), *columns)
+
+    # change values to "DNF" if their value is 0 and the column name does not contain "indicator"
+    rows = [{key: "DNF" if (value == 0) and ('indicator' not in key) else value for key, value in row.items()}
+            for row in points_df.to_dict('records')]
+
+    # a staging table left by a failed load or swap is dropped, create table commits implicitly on mysql
+    try:
+        # load the staging table with a single executemany
+        with engine.begin() as connection:
+            staging_table.create(connection)
+            connection.execute(staging_table.insert(), rows)
+
+        # swap the staging table in, only the table being replaced is looked up
+        replace_existing = inspect(engine).has_table(table_name)
+        with engine.begin() as connection:
+            if engine.dialect.name == 'mysql':
+                # mysql renames several tables in one atomic statement
+                if replace_existing:
+                    connection.execute(text(f'RENAME TABLE {quote(table_name)} TO {quote(old_name)}, {quote(staging_name)} TO {quote(table_name)}'))
                 else:
-                    tour_license = True
-            except:
-                tour_license = False
-            player.player_sda_id = sda_player['SDA'].values[0]
-            player.player_swisstour_license = tour_license
-            session.commit()
-            print(f'Added SDA info for player {player.player_firstname} {player.player_lastname}.')
+                    connection.execute(text(f'RENAME TABLE {quote(staging_name)} TO {quote(table_name)}'))
+            else:
+                # postgresql and sqlite rename tables inside a transaction
+                if replace_existing:
+                    connection.execute(text(f'ALTER TABLE {quote(table_name)} RENAME TO {quote(old_name)}'))
+                connection.execute(text(f'ALTER TABLE {quote(staging_name)} RENAME TO {quote(table_name)}'))
+    except Exception:
+        staging_table.drop(engine, checkfirst=True)
+        raise
+    if replace_existing:
+        with engine.begin() as connection:
+            connection.execute(text(f'DROP TABLE {quote(old_name)}'))
 
-def calculate_swisstour_pts(max_pts_dict:dict):
+    # remember the published standings
+    with get_session() as session:
+        session.merge(SyncState(sync_state_name=table_name,sync_state_hash=content_hash,sync_state_synced_at=datetime.datetime.now()))
+        session.commit()
+    return True
+
+def tournament_divisions() -> list:
     """
-    Calculate the swisstour points for each event in the database.
+    Return the divisions of all tournaments in the database.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        return [n for n, in session.query(Tournament.tournament_division).distinct()]
+
+def standing_rows(division:str,max_pts_dict:dict) -> list:
+    """
+    Rank the licensed players of a division for the normalized standings, with the same best results and places
+    as the standings table. Returns a dictionary per player with the player_id, total, place and the points
+    of each event of the season, and whether they count for the total.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        results = session.query(Tournament.player_id,
+                                Tournament.event_id,
+                                Tournament.tournament_swisstour_points).join(
+                                    Player, Tournament.player_id == Player.player_id).filter(
+                                        Player.player_swisstour_license == True,
+                                        Tournament.tournament_division == division,
+                                        Tournament.event_id.in_(list(max_pts_dict))).order_by(
+                                            Tournament.player_id, Tournament.tournament_id).all()
+    results_df = pd.DataFrame(results, columns=['player_id','event_id','points'])
+    if results_df.empty:
+        return []
+    # one row per player and one column per event, in the order they first appear like in the standings table
+    points = results_df.pivot_table(index='player_id', columns='event_id', values='points', aggfunc='last', dropna=False)
+    points = points[results_df.event_id.unique()]
+    values = points.to_numpy(dtype=float)
+    totals, counted = top_n_points(values)
+    places = pd.Series(totals).rank(ascending=False,method='min').astype(int).to_numpy()
+    return [{'player_id': int(player_id),
+             'standing_total': int(totals[idx]),
+             'standing_place': int(places[idx]),
+             'events': [{'event_id': int(event_id),
+                         'standing_event_points': int(values[idx,col]),
+                         'standing_event_counted': bool(counted[idx,col])}
+                        for col, event_id in enumerate(points.columns) if not np.isnan(values[idx,col])]}
+            for idx, player_id in enumerate(points.index)]
+
+@timed_stage('publish_rows','division')
+def publish_standing_rows(season:int,division:str,rows:list) -> bool:
+    """
+    Replace the normalized standings of a division in a season with the given rows in one transaction.
+    Standings that did not change since they were last published are kept, returns whether they were replaced.
+    """
+    state_name = f'standings_{season}_{division}'
+    content_hash = hashlib.sha256(repr(rows).encode()).hexdigest()
+    # open a session on the shared database engine
+    with get_session() as session:
+        sync_state = session.get(SyncState,state_name)
+        if sync_state is not None and sync_state.sync_state_hash == content_hash:
+            print(f'Standing rows of {division} in {season} are up to date.')
+            return False
+
+        in_division = (Standing.standing_season == season, Standing.standing_division == division)
+        session.execute(delete(StandingEvent).where(StandingEvent.standing_id.in_(select(Standing.standing_id).where(*in_division))))
+        session.execute(delete(Standing).where(*in_division))
+        standings = [{'standing_season': season, 'standing_division': division,
+                      **{key: value for key, value in row.items() if key != 'events'}} for row in rows]
+        for start in range(0,len(standings),BATCH_SIZE):
+            session.execute(insert(Standing),standings[start:start+BATCH_SIZE])
+        standing_ids = dict(session.query(Standing.player_id,Standing.standing_id).filter(*in_division))
+        standing_events = [{'standing_id': standing_ids[row['player_id']], **event} for row in rows for event in row['events']]
+        for start in range(0,len(standing_events),BATCH_SIZE):
+            session.execute(insert(StandingEvent),standing_events[start:start+BATCH_SIZE])
+        session.merge(SyncState(sync_state_name=state_name,sync_state_hash=content_hash,sync_state_synced_at=datetime.datetime.now()))
+        session.commit()
+    print(f'Published {len(rows)} standing rows of {division} in {season}.')
+    return True
+
+def standings_frames(event_order_and_pts:dict,divisions:list=None) -> dict:
+    """
+    Build the standings of each division, or only of the given divisions, without publishing them.
+    Returns a dictionary of standings dataframes keyed by division, divisions without standings are left out.
     """
-    # create connection to the database
-    engine=create_engine(DB_URL, poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
-        # get all events from the database
-        events = session.query(Event).all()
-        for event in events:
-            # create dictionary for assigning points to place
-            pts_dict = {
-                1: 100, 2: 90, 3: 81, 4: 73, 5: 66,
-                6: 60, 7: 55, 8: 50, 9: 46, 10: 42,
-                11: 38, 12: 35, 13: 32, 14: 29, 15: 26,
-                16: 23, 17: 21, 18: 19, 19: 17, 20: 15,
-                21: 13, 22: 11, 23: 10, 24: 9, 25: 8,
-                26: 7, 27: 6, 28: 5,
-            }
-            event_id = event.event_id
-            max_pts = max_pts_dict[event_id][0]
-            # adjust the points based on the max points
-            pts_dict = {k: int(np.ceil(v*(max_pts/100))) for k, v in pts_dict.items()}
-
-            # get all tournaments from the database corresponding to the selected event  
-            tournaments = session.query(Tournament).filter(Tournament.event_id == event_id).all()
-    
-            # get all the divisions for particular event
-            divisions = sorted(list(set([tournament.tournament_division for tournament in tournaments])))
-            for division in divisions:
-                # get all the tournaments filtered by event_id and division
-                tournaments = session.query(Tournament).filter(and_(Tournament.event_id == event_id,Tournament.tournament_division == division)).all()
-                n = len(tournaments)
-                tournament_places = [tournament.tournament_place for tournament in tournaments]
-                for tournament in tournaments:
-                    # check if there are ties and divide points evenly
-                    ties = len([place for place in tournament_places if place == tournament.tournament_place])
-                    if tournament.tournament_place in pts_dict:
-                        if ties == 1:
-                            pts = pts_dict[tournament.tournament_place]
-                        else:
-                            total_pts = 0
-                            for t in np.arange(ties):
-                                try:
-                                    total_pts += pts_dict[tournament.tournament_place + t]
-                                except:
-                                    total_pts += min(list(pts_dict.values()))
-                            pts = total_pts/ties
-                    else:
-                        pts = min(list(pts_dict.values()))
-                    if tournament.tournament_score != 999 and tournament.tournament_score != 888:
-                        tournament.tournament_swisstour_points = int(pts)
-                    else:
-                        tournament.tournament_swisstour_points = 0 # do not give points to DNF tournaments  
-                    # write the points to the database
-                    session.commit()
-                    print(f'Added swisstour points for event {event_id} and player {tournament.player_id}.')
-
-def create_standings(event_order_and_pts:dict):
     event_order = [key for key in event_order_and_pts]
-    # create connection to the database
-    engine=create_engine(DB_URL, poolclass=NullPool)
-    Session=sessionmaker(bind=engine)
-    with Session() as session:
-        # Create a table of rankings for each division
-        divisions = session.query(Tournament.tournament_division).distinct().all()
+    frames = {}
+    # open a session on the shared database engine
+    with get_session() as session:
+        # Create a table of rankings for each division, or only for the given divisions
+        if divisions is None:
+            divisions = tournament_divisions()
         for division in divisions:
-            division = division[0]
         
             # Join Event and Tournament tables and filter by division
             event_info = session.query(Tournament.event_id, Event.event_name).join(
@@ -433,48 +1014,19 @@ def create_standings(event_order_and_pts:dict):
                 points_df = points_df.replace({pd.NA: None, np.nan: None})
 
                 # Round the points to 1 decimal place
-                points_df = points_df.round(0)
-
-                # Drop the standings table if it exists
-                metadata = MetaData()
-                metadata.reflect(bind=engine)
-                if f'standings_{division}' in metadata.tables:
-                    rankings_table = Table(f'standings_{division}', metadata, autoload_with=engine)
-                    rankings_table.drop(engine)
-                
-                # Create the standings table dynamically
-                Base = declarative_base()
-                
-                # Create the standings table
-                attributes = {
-                    '__tablename__': f'standings_{division}',
-                    'standing_id': Column(Integer(), primary_key=True)       
-                }
-                    
-                column_names = points_df.columns
-                for column_name in column_names:                
-                    if (column_name == 'Place'):
-                        attributes[column_name] = Column(Integer())
-                    elif ("indicator" in column_name) or (column_name == "SDA License") or (column_name =="player"):
-                        attributes[column_name] = Column(String(100))
-                    else:
-                        attributes[column_name] = Column(String(100))
-                        
-                # Create the class dynamically
-                Standing = type(f'Standing_{division}', (Base,), attributes)
-                
-                # Create the table in the database
-                Base.metadata.create_all(engine)
-
-                # Populate the standings table
-                for row in points_df.iterrows():
-                    row_dict = row[1].to_dict()
-
-                    # Change values to "DNF" if their value is 0 and the column name contains "indicator"
-                    for key, value in row_dict.items():
-                        if (value == 0) and ('indicator' not in key):
-                            row_dict[key] = "DNF"
-                            
-                    points = Standing(**row_dict)
-                    session.add(points)
-                session.commit()
\ No newline at end of file
+                frames[division] = points_df.round(0)
+    return frames
+
+@timed_stage('standings')
+def create_standings(event_order_and_pts:dict,divisions:list=None,season:int=None,wide:bool=True):
+    """
+    Publish the standings of each division, or only of the given divisions: the normalized standings rows
+    if a season is given, and the standings table of each division unless wide is False.
+    """
+    if season is not None:
+        for division in (divisions if divisions is not None else tournament_divisions()):
+            publish_standing_rows(season, division, standing_rows(division, event_order_and_pts))
+    if wide:
+        for division, points_df in standings_frames(event_order_and_pts,divisions).items():
+            # Bulk load the standings and swap them in atomically
+            publish_standings_table(division, points_df)
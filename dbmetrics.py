@@ -0,0 +1,125 @@
+# This file collects the timings and counters of a run: stages, sql statements, http requests and page parsing
+from sqlalchemy import event
+import contextlib
+import csv
+import functools
+import inspect
+import json
+import threading
+import time
+
+# counters of the whole run, the stages record how much of each counter they used
+COUNTERS = ['sql_statements','sql_commits','http_requests','http_bytes','http_seconds','cache_hits',
+            'parsed_pages','parse_seconds']
+
+_lock = threading.Lock()
+_counters = dict.fromkeys(COUNTERS,0)
+_stages = []
+
+def reset():
+    """
+    Reset all counters and recorded stages.
+    """
+    with _lock:
+        _counters.update(dict.fromkeys(COUNTERS,0))
+        _stages.clear()
+
+def add(counter:str,value=1):
+    """
+    Add a value to one of the counters.
+    """
+    with _lock:
+        _counters[counter] += value
+
+def record_http(size:int,seconds:float):
+    """
+    Record an http request with the size of the response and its latency.
+    """
+    with _lock:
+        _counters['http_requests'] += 1
+        _counters['http_bytes'] += size
+        _counters['http_seconds'] += seconds
+
+def record_parse(seconds:float,pages:int=1):
+    """
+    Record the time spent parsing pages.
+    """
+    with _lock:
+        _counters['parsed_pages'] += pages
+        _counters['parse_seconds'] += seconds
+
+def _count_statement(*args):
+    add('sql_statements')
+
+def _count_commit(*args):
+    add('sql_commits')
+
+def instrument_engine(engine):
+    """
+    Count the sql statements and commits of an engine.
+    """
+    if not event.contains(engine,'before_cursor_execute',_count_statement):
+        event.listen(engine,'before_cursor_execute',_count_statement)
+        event.listen(engine,'commit',_count_commit)
+
+@contextlib.contextmanager
+def stage(name:str,**labels):
+    """
+    Record the wall time of a stage and how much of each counter it used.
+    Labels, e.g. the event_id, are stored with the stage.
+    """
+    with _lock:
+        before = dict(_counters)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        with _lock:
+            _stages.append({'stage': name, **labels, 'seconds': seconds,
+                            **{counter: _counters[counter] - before[counter] for counter in COUNTERS}})
+
+def timed_stage(name:str,*label_arguments:str):
+    """
+    Decorator that records each call of a function as a stage, labelled with the given arguments of the call.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            arguments = signature.bind(*args,**kwargs).arguments
+            with stage(name,**{label: arguments[label] for label in label_arguments if label in arguments}):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def get_stages() -> list:
+    """
+    Return the recorded stages in the order they finished.
+    """
+    with _lock:
+        return [dict(n) for n in _stages]
+
+def get_totals() -> dict:
+    """
+    Return the counters of the whole run.
+    """
+    with _lock:
+        return dict(_counters)
+
+def write_report(path:str):
+    """
+    Write the recorded stages and the totals of the run to a json file, or to a csv file
+    with one row per stage if the path ends with .csv.
+    """
+    stages = get_stages()
+    if path.endswith('.csv'):
+        columns = ['stage'] + sorted(set(key for n in stages for key in n) - set(['stage','seconds'] + COUNTERS)) + ['seconds'] + COUNTERS
+        with open(path,'w',newline='') as f:
+            writer = csv.DictWriter(f,fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(stages)
+    else:
+        with open(path,'w') as f:
+            json.dump({'stages': stages, 'totals': get_totals()},f,indent=2,default=str)
+    print(f'Wrote the metrics report to {path}')
@@ -1,8 +1,8 @@
 # Running this file creates the tables in the database
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, inspect, select, update, delete, func, text
 from sqlalchemy.orm import declarative_base
-from dbconn import DB_URL
+from dbconn import get_engine
 
 Base = declarative_base()
 
@@ -28,6 +28,9 @@ class Player(Base):
     player_no_events = Column(Integer())
     player_no_wins = Column(Integer())
     player_earnings = Column(Float())
+    player_scraped_at = Column(DateTime())
+
+    __table_args__ = (Index('ux_players_pdga_id','player_pdga_id',unique=True),)
 
 class Event(Base):
     __tablename__ = 'events'
@@ -57,7 +60,107 @@ class Tournament(Base):
     tournament_propagator = Column(Boolean())
     tournament_score = Column(Integer())
 
-# Create the engine
-engine = create_engine(DB_URL)
-# Create the tables
-Base.metadata.create_all(engine)
\ No newline at end of file
+    # a player has at most one tournament per event, the upserts of the ingestion conflict on it
+    __table_args__ = (Index('ux_tournaments_player_event','player_id','event_id',unique=True),
+                      Index('ix_tournaments_event_division','event_id','tournament_division'))
+
+class PointsState(Base):
+    __tablename__ = 'points_states'
+
+    event_id = Column(Integer(),ForeignKey(Event.event_id,ondelete='CASCADE'),primary_key=True)
+    points_state_division = Column(String(100),primary_key=True)
+    points_state_max_pts = Column(Integer())
+    points_state_fingerprint = Column(String(64))
+
+class SyncState(Base):
+    __tablename__ = 'sync_states'
+
+    sync_state_name = Column(String(100), primary_key=True)
+    sync_state_hash = Column(String(64))
+    sync_state_synced_at = Column(DateTime())
+
+class Standing(Base):
+    __tablename__ = 'standings'
+
+    standing_id = Column(Integer(), primary_key=True)
+    standing_season = Column(Integer(), nullable=False)
+    standing_division = Column(String(100), nullable=False)
+    player_id = Column(Integer(),ForeignKey(Player.player_id,ondelete='CASCADE'),nullable=False)
+    standing_total = Column(Integer())
+    standing_place = Column(Integer())
+
+    __table_args__ = (Index('ux_standings_season_division_player','standing_season','standing_division','player_id',unique=True),
+                      Index('ix_standings_season_division_place','standing_season','standing_division','standing_place'))
+
+class StandingEvent(Base):
+    __tablename__ = 'standing_events'
+
+    standing_id = Column(Integer(),ForeignKey(Standing.standing_id,ondelete='CASCADE'),primary_key=True)
+    event_id = Column(Integer(),ForeignKey(Event.event_id,ondelete='CASCADE'),primary_key=True)
+    standing_event_points = Column(Integer())
+    standing_event_counted = Column(Boolean)
+
+    __table_args__ = (Index('ix_standing_events_event','event_id'),)
+
+def dedupe_rows(connection):
+    """
+    Remove the duplicates that would violate the unique indexes. Players with the same pdga number are merged
+    into the one with the lowest player_id, of several tournaments of a player at the same event the last one is kept.
+    """
+    players = Player.__table__
+    tournaments = Tournament.__table__
+    duplicates = connection.execute(select(players.c.player_pdga_id,func.min(players.c.player_id)).where(
+        players.c.player_pdga_id.isnot(None)).group_by(players.c.player_pdga_id).having(func.count() > 1)).all()
+    for pdga_id, player_id in duplicates:
+        other_ids = [n for n, in connection.execute(select(players.c.player_id).where(
+            players.c.player_pdga_id == pdga_id,players.c.player_id != player_id))]
+        connection.execute(update(tournaments).where(tournaments.c.player_id.in_(other_ids)).values(player_id=player_id))
+        connection.execute(delete(players).where(players.c.player_id.in_(other_ids)))
+    if duplicates:
+        print('Merged the duplicates of {} players.'.format(len(duplicates)))
+
+    duplicates = connection.execute(select(tournaments.c.player_id,tournaments.c.event_id,func.max(tournaments.c.tournament_id)).group_by(
+        tournaments.c.player_id,tournaments.c.event_id).having(func.count() > 1)).all()
+    for player_id, event_id, tournament_id in duplicates:
+        connection.execute(delete(tournaments).where(tournaments.c.player_id == player_id,tournaments.c.event_id == event_id,
+                                                     tournaments.c.tournament_id != tournament_id))
+    if duplicates:
+        print('Removed the duplicate tournaments of {} players and events.'.format(len(duplicates)))
+
+def migrate_schema(engine=None):
+    """
+    Bring the tables of an existing database up to date: add the missing (nullable) columns and create
+    the missing indexes, after removing the duplicates that would violate the unique ones.
+    """
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            columns = set(n['name'] for n in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in columns:
+                    connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                        table.name,column.name,column.type.compile(dialect=connection.dialect))))
+                    print('Added column {} to {}.'.format(column.name,table.name))
+
+        missing = [index for table in Base.metadata.sorted_tables
+                   for index in table.indexes
+                   if index.name not in set(n['name'] for n in inspector.get_indexes(table.name))]
+        if not missing:
+            return
+        if any(index.unique for index in missing):
+            dedupe_rows(connection)
+        for index in missing:
+            index.create(connection)
+            print('Created index {} on {}.'.format(index.name,index.table.name))
+
+def init_schema(engine=None):
+    """
+    Create the tables that do not exist yet in the database and migrate the existing ones.
+    """
+    engine = engine or get_engine()
+    Base.metadata.create_all(engine)
+    migrate_schema(engine)
+
+if __name__ == '__main__':
+    init_schema()
@@ -0,0 +1,187 @@
+# This file projects the final standings of a division by simulating the remaining events of the season
+from dbconn import get_session
+from dbobjects import Event, Player, Tournament
+from dbinteract import shared_place_pts, top_n_points
+from dbseason import load_season
+import argparse
+import numpy as np
+import pandas as pd
+
+# number of simulated seasons
+SIMULATIONS = 10000
+
+# number of array cells of a chunk of simulations, bounds the memory of the projection
+CHUNK_CELLS = 2_000_000
+
+def load_division(division:str,event_order_and_pts:dict) -> dict:
+    """
+    Load the results of a division for the events of the season: the points of the licensed players
+    (players x events, NaN for a skipped event), the relative finishes of their results, their attendance
+    and the field size of each event.
+    """
+    # open a session on the shared database engine
+    with get_session() as session:
+        results = session.query(Tournament.player_id,
+                                Tournament.event_id,
+                                Tournament.tournament_place,
+                                Tournament.tournament_swisstour_points,
+                                Player.player_firstname,
+                                Player.player_lastname,
+                                Player.player_swisstour_license).join(
+                                    Player, Tournament.player_id == Player.player_id).filter(
+                                        Tournament.tournament_division == division,
+                                        Tournament.event_id.in_(list(event_order_and_pts))).all()
+        ingested = set(n for n, in session.query(Event.event_id).filter(Event.event_id.in_(list(event_order_and_pts))))
+    results_df = pd.DataFrame(results, columns=['player_id','event_id','place','points','firstname','lastname','license'])
+    field_sizes = results_df.groupby('event_id').size()
+    licensed = results_df[results_df.license == True].copy()
+    # relative finish of each result, 0 for a win
+    licensed['finish'] = (licensed.place - 1)/licensed.event_id.map(field_sizes)
+
+    events = [n for n in event_order_and_pts if n in field_sizes.index]
+    points = licensed.pivot_table(index='player_id', columns='event_id', values='points', aggfunc='last', dropna=False)
+    points = points.reindex(columns=events)
+    players = licensed.drop_duplicates('player_id').set_index('player_id').loc[points.index]
+    finishes = licensed.groupby('player_id').finish.apply(list).loc[points.index]
+    return {'events': events,
+            'player_ids': points.index.to_numpy(),
+            'players': (players.firstname + ' ' + players.lastname).to_numpy(),
+            'points': points.to_numpy(dtype=float),
+            'finishes': finishes.tolist(),
+            'attendance': (points.notna().sum(axis=1)/max(len(events),1)).to_numpy(),
+            'field_size': int(round(field_sizes.mean())) if len(field_sizes) else len(points),
+            'ingested': ingested}
+
+def simulate_places(rng,finishes:np.ndarray,counts:np.ndarray,attendance:np.ndarray,field_size:int,shape:tuple):
+    """
+    Simulate the places of the players (simulations x players x events). A player attends an event with
+    the probability of the attendance so far and finishes like one of the past results, drawn at random.
+    """
+    attend = rng.random(shape) < attendance[None,:,None]
+    draws = (rng.random(shape)*counts[None,:,None]).astype(np.int64)
+    finish = finishes[np.arange(shape[1])[None,:,None], draws]
+    places = np.floor(finish*field_size + rng.random(shape)).astype(np.int64) + 1
+    return np.clip(places, 1, field_size), attend
+
+def count_ties(places:np.ndarray,attend:np.ndarray) -> np.ndarray:
+    """
+    Count the attending players on the same place in the same simulated event.
+    """
+    simulations, players, events = places.shape
+    # one key per simulation, event and place
+    keys = (np.arange(simulations)[:,None,None]*events + np.arange(events)[None,None,:])*(places.max() + 1) + places
+    keys = np.where(attend, keys, -1)
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return counts[inverse].reshape(places.shape)
+
+def project_division(division:str,event_order_and_pts:dict,remaining:list=None,simulations:int=SIMULATIONS,seed:int=None) -> dict:
+    """
+    Simulate the remaining events of the season for a division, by default the events of the season
+    that are not in the database yet. The points of the simulated places use the same scaling, shared points of
+    tied players and best results as the standings.
+    Returns a dictionary with the players, their current totals, the simulated totals (simulations x players)
+    and a dataframe of the probabilities of each final place.
+    """
+    division_data = load_division(division,event_order_and_pts)
+    if remaining is None:
+        remaining = [n for n in event_order_and_pts if n not in division_data['ingested']]
+    # results of remaining events that are already in the database are simulated again
+    current = division_data['points'][:, [idx for idx, n in enumerate(division_data['events']) if n not in remaining]]
+    no_players = len(current)
+    if not no_players:
+        raise ValueError(f'There are no licensed players in the division {division}')
+    counts = np.array([len(n) for n in division_data['finishes']])
+    finishes = np.zeros((no_players, max(counts.max(initial=0),1)))
+    for idx, player_finishes in enumerate(division_data['finishes']):
+        finishes[idx,:len(player_finishes)] = player_finishes
+    field_size = division_data['field_size']
+
+    rng = np.random.default_rng(seed)
+    totals = np.zeros((simulations, no_players))
+    chunk = max(1, CHUNK_CELLS//max(no_players*max(no_players, current.shape[1] + len(remaining)), 1))
+    for start in range(0, simulations, chunk):
+        size = min(chunk, simulations - start)
+        simulated = np.empty((size, no_players, 0))
+        if remaining:
+            places, attend = simulate_places(rng, finishes, counts, division_data['attendance'], field_size,
+                                             (size, no_players, len(remaining)))
+            ties = count_ties(places, attend)
+            simulated = np.stack([np.trunc(shared_place_pts(places[:,:,idx], ties[:,:,idx], event_order_and_pts[event_id][0]))
+                                  for idx, event_id in enumerate(remaining)], axis=2)
+            simulated = np.where(attend, simulated, np.nan)
+        season_points = np.concatenate((np.broadcast_to(current, (size,) + current.shape), simulated), axis=2)
+        totals[start:start+size] = top_n_points(season_points.reshape(size*no_players, -1))[0].reshape(size, no_players)
+
+    # final places ranked like the standings, tied totals share the best place
+    places = np.zeros((simulations, no_players), dtype=np.int64)
+    for start in range(0, simulations, chunk):
+        block = totals[start:start+chunk]
+        places[start:start+chunk] = (block[:,None,:] > block[:,:,None]).sum(axis=2) + 1
+    place_counts = np.bincount((np.arange(no_players)[None,:]*no_players + places - 1).ravel(),
+                               minlength=no_players*no_players).reshape(no_players, no_players)
+
+    probabilities = pd.DataFrame(place_counts/simulations, columns=range(1, no_players + 1))
+    probabilities.insert(0, 'player', division_data['players'])
+    probabilities.insert(1, 'current', top_n_points(current)[0])
+    probabilities.insert(2, 'expected', totals.mean(axis=0))
+    probabilities.insert(3, 'expected_place', places.mean(axis=0))
+    probabilities = probabilities.sort_values('expected_place').reset_index(drop=True)
+    return {'division': division,
+            'remaining': remaining,
+            'players': division_data['players'],
+            'current': current,
+            'totals': totals,
+            'field_size': field_size,
+            'max_pts': [event_order_and_pts[n][0] for n in remaining],
+            'probabilities': probabilities}
+
+def required_finish(projection:dict,target_rank:int,probability:float=0.5) -> pd.DataFrame:
+    """
+    Find for each player the worst place to finish at every remaining event that still reaches target_rank
+    or better with at least the given probability, against the simulated totals of the other players.
+    Players that cannot reach the target rank get no place.
+    """
+    current, totals = projection['current'], projection['totals']
+    no_players = len(current)
+    candidates = np.arange(1, projection['field_size'] + 1)
+    # season points of each player for each candidate place at all remaining events (players x candidates)
+    remaining_pts = np.stack([np.trunc(shared_place_pts(candidates, np.ones_like(candidates), max_pts))
+                              for max_pts in projection['max_pts']], axis=1) if projection['max_pts'] else np.zeros((len(candidates), 0))
+    season_points = np.concatenate((np.repeat(current[:,None,:], len(candidates), axis=1),
+                                    np.broadcast_to(remaining_pts, (no_players,) + remaining_pts.shape)), axis=2)
+    candidate_totals = top_n_points(season_points.reshape(no_players*len(candidates), -1))[0].reshape(no_players, len(candidates))
+
+    if no_players - 1 < target_rank:
+        reach = np.ones((no_players, len(candidates)))
+    else:
+        # the total of the player ranked target_rank among the others in each simulation, it is the total ranked
+        # target_rank + 1 overall if the player itself is ranked target_rank or better
+        best = -np.sort(np.partition(-totals, target_rank, axis=1)[:, :target_rank + 1], axis=1)
+        thresholds = np.where(totals >= best[:, [target_rank - 1]], best[:, [target_rank]], best[:, [target_rank - 1]])
+        thresholds = np.sort(thresholds, axis=0)
+        reach = np.stack([np.searchsorted(thresholds[:, idx], candidate_totals[idx], side='right')
+                          for idx in range(no_players)])/len(totals)
+
+    rows = []
+    for idx in range(no_players):
+        reached = np.nonzero(reach[idx] >= probability)[0]
+        rows.append({'player': projection['players'][idx],
+                     'required_place': int(candidates[reached[-1]]) if len(reached) else None,
+                     'probability': float(reach[idx, reached[-1]]) if len(reached) else float(reach[idx, 0])})
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Project the final standings of a division by simulating the remaining events.')
+    parser.add_argument('division')
+    parser.add_argument('--season', default='season_2025.json', help='season config file with the events, their max points and short names')
+    parser.add_argument('--remaining', type=int, nargs='*', help='event ids of the remaining events, by default the events that are not in the database yet')
+    parser.add_argument('--simulations', type=int, default=SIMULATIONS)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--target', type=int, help='show the place each player needs at the remaining events to reach this rank')
+    args = parser.parse_args()
+    projection = project_division(args.division,load_season(args.season)['event_order_and_pts'],args.remaining,
+                                  args.simulations,args.seed)
+    print('Remaining events: {}'.format(', '.join(str(n) for n in projection['remaining']) or 'none'))
+    print(projection['probabilities'].round(3).to_string(index=False))
+    if args.target:
+        print(required_finish(projection,args.target).to_string(index=False))
@@ -1,8 +1,51 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from termcolor import colored
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from collections import namedtuple
+import dbmetrics
 import pandas as pd
 import datetime 
+import hashlib
+import gzip
+import html
+import json
+import os
+import re
+import threading
+import time
+
+# settings for scraping several pages concurrently
+MAX_WORKERS = 8                 # maximum number of pages downloaded at the same time
+MIN_REQUEST_INTERVAL = 0.25     # minimum number of seconds between two requests to the same host
+
+# settings for the on-disk response cache
+CACHE_DIR = os.getenv('PDGA_CACHE_DIR','.pdga_cache')
+CACHE_TTL = {'event': 6*60*60,          # event pages change while results are coming in
+             'player': 7*24*60*60}      # player pages only change with ratings and memberships
+OFFLINE = os.getenv('PDGA_OFFLINE','0') == '1'    # serve pages only from the cache
+
+# html parser used for the pdga pages, lxml is used when it is installed and html.parser is the fallback
+try:
+    import lxml
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+PARSER = os.getenv('PDGA_PARSER', DEFAULT_PARSER)
+
+# only these parts of an event page are parsed, the title is read directly from the raw page
+EVENT_PAGE_PARTS = ['pane-tournament-event-info','event-info','summary','leaderboard']
+TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+# one row of a division leaderboard
+TournamentResult = namedtuple('TournamentResult',['name','pdga_number','division','total','place','rating',
+                                                  'propagator','rounds','ratings','prize'])
+
+# state shared by the scraping threads
+_thread_local = threading.local()
+_host_lock = threading.Lock()
+_host_next_request = {}
 
 # helper functions
 def parse_info(metadata_soup,class_name:str,name:str,var_type:type=str) -> str:
@@ -66,21 +109,197 @@ def separate_status(string:str):
         date = '2099-01-01T00:00:00'
     return status, date
 
-# main functions
-def pdga_event(event_number:int,event_only:bool = False) -> pd.core.frame.DataFrame:
+def wait_for_host(web_address:str,min_interval:float=MIN_REQUEST_INTERVAL):
     """
-    Scrapes the event metadata from the the pdga website, given the event number.
-    Returns a dictionary of event metadata and a pandas dataframe of tournaments.
+    Block until the per-host rate limit allows another request to the host of the web address.
     """
-    print(colored('Scraping event {} from pdga website.'.format(str(event_number)),'red'))
-    # load the html of the event
-    web_address = 'https://www.pdga.com/tour/event/' + str(event_number)
-    page = requests.get(web_address)
-    soup = BeautifulSoup(page.content, 'html.parser')
+    host = urlparse(web_address).netloc
+    with _host_lock:
+        now = time.monotonic()
+        slot = max(now,_host_next_request.get(host,now))
+        _host_next_request[host] = slot + min_interval
+    if slot > now:
+        time.sleep(slot - now)
+
+def set_offline(offline:bool=True):
+    """
+    Switch the offline mode on or off. In offline mode pages are only served from the cache.
+    """
+    global OFFLINE
+    OFFLINE = offline
+
+def cache_paths(web_address:str):
+    """
+    Return the paths of the compressed body and the metadata of a cached web address.
+    """
+    key = hashlib.sha256(web_address.encode()).hexdigest()
+    return os.path.join(CACHE_DIR,key + '.gz'), os.path.join(CACHE_DIR,key + '.json')
+
+def read_cache(web_address:str):
+    """
+    Return the cached metadata and body of a web address, or None for both if it is not cached.
+    """
+    body_path, meta_path = cache_paths(web_address)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with gzip.open(body_path,'rb') as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+    return meta, body
+
+def write_file_atomic(path:str,data:bytes):
+    """
+    Write a file through a temporary file, so that concurrent readers never see a partial file.
+    """
+    tmp_path = '{}.{}.{}.tmp'.format(path,os.getpid(),threading.get_ident())
+    with open(tmp_path,'wb') as f:
+        f.write(data)
+    os.replace(tmp_path,path)
+
+def write_cache(web_address:str,body:bytes,meta:dict):
+    """
+    Store the compressed body and the metadata of a web address in the cache.
+    """
+    os.makedirs(CACHE_DIR,exist_ok=True)
+    body_path, meta_path = cache_paths(web_address)
+    if body is not None:
+        write_file_atomic(body_path,gzip.compress(body))
+    write_file_atomic(meta_path,json.dumps(meta).encode())
+
+def fetch_page(web_address:str,resource:str='page',min_interval:float=MIN_REQUEST_INTERVAL,max_age:float=None) -> bytes:
+    """
+    Download a page politely and return its content. Each thread reuses its own http session.
+    Fresh pages are served from the on-disk cache, expired pages are revalidated with a conditional request.
+    max_age overrides how many seconds a cached page stays fresh, by default the cache ttl of the resource.
+    """
+    if max_age is None:
+        max_age = CACHE_TTL.get(resource,0)
+    meta, body = read_cache(web_address)
+    if body is not None and (OFFLINE or time.time() - meta['fetched_at'] < max_age):
+        dbmetrics.add('cache_hits')
+        return body
+    if OFFLINE:
+        raise FileNotFoundError('{} is not in the cache and offline mode is enabled.'.format(web_address))
+
+    # ask the server to only send the page if it changed since it was cached
+    headers = {}
+    if body is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    if not hasattr(_thread_local,'session'):
+        _thread_local.session = requests.Session()
+    wait_for_host(web_address,min_interval)
+    start_time = time.perf_counter()
+    page = _thread_local.session.get(web_address,headers=headers)
+    dbmetrics.record_http(len(page.content),time.perf_counter() - start_time)
+
+    if page.status_code == 304 and body is not None:
+        meta['fetched_at'] = time.time()
+        write_cache(web_address,None,meta)
+        return body
+    if page.status_code == 200:
+        write_cache(web_address,page.content,{
+            'url': web_address,
+            'fetched_at': time.time(),
+            'etag': page.headers.get('ETag'),
+            'last_modified': page.headers.get('Last-Modified')
+        })
+    return page.content
+
+def row_elements(row) -> dict:
+    """
+    Collect all elements of a leaderboard row by class name in a single pass over the row.
+    """
+    elements = {}
+    for element in row.find_all(class_=True):
+        for class_name in element['class']:
+            elements.setdefault(class_name,[]).append(element)
+    return elements
+
+def parse_result_row(row,division:str) -> TournamentResult:
+    """
+    Parse one row of a division leaderboard into a tournament result.
+    """
+    elements = row_elements(row)
+    # player
+    name = elements['player'][0].text
+    try:
+        pdga_number = int(elements['pdga-number'][0].text)
+    except:
+        pdga_number = 0
+    # total
+    try:
+        total_score = int(elements['total'][0].text)
+    except:
+        total_score = 999
+    # place
+    place = int(elements['place'][0].text)
+    # player rating
+    try:
+        player_rating = int(elements['player-rating'][0].text)
+    except:
+        player_rating = 0
+    try:
+        prize = float(elements['prize'][0].text.replace('$','').replace(',',''))
+    except:
+        prize = 0
+    return TournamentResult(
+        name=name,
+        pdga_number=pdga_number,
+        division=division,
+        total=total_score,
+        place=place,
+        rating=player_rating,
+        propagator='propagator' in elements,
+        rounds=[round.text for round in elements.get('round',[])],
+        ratings=[rating.text for rating in elements.get('round-rating',[])],
+        prize=prize
+    )
+
+def iter_leaderboard(soup):
+    """
+    Yield the tournament results of all divisions of a parsed event page as they are parsed.
+    A division that cannot be parsed ends the leaderboard.
+    """
+    # the results tables for each division are in details containers of the leaderboard
+    results = soup.find(class_='leaderboard')
+    try:
+        for category in results.find_all('details'):
+            # extract the division
+            division = category.find(class_='division').text.split()[0]
+            # the rows of the table alternate between the classes odd and even
+            for tournament in category.find_all(class_=['odd','even']):
+                start_time = time.perf_counter()
+                result = parse_result_row(tournament,division)
+                dbmetrics.record_parse(time.perf_counter() - start_time,pages=0)
+                yield result
+    except Exception:
+        return
+
+def results_frame(results) -> pd.DataFrame:
+    """
+    Build a pandas dataframe of tournaments from tournament results.
+    """
+    return pd.DataFrame(list(results),columns=TournamentResult._fields)
+
+def parse_event_page(content:bytes,event_only:bool=False,parser:str=None,as_frame:bool=True):
+    """
+    Parse the html of an event page into a dictionary of event metadata and the tournaments of the event.
+    The tournaments are a pandas dataframe, or a generator of tournament results if as_frame is False.
+    Only the event info, summary and leaderboard parts of the page are parsed.
+    """
+    start_time = time.perf_counter()
+    soup = BeautifulSoup(content, parser or PARSER, parse_only=SoupStrainer(class_=EVENT_PAGE_PARTS))
 
     # parse the html for the event metadata and save to dictionary 
     event_data = {}
-    event_data['name'] = soup.title.text.split('|')[0][:-1]
+    title = TITLE_PATTERN.search(content).group(1).decode('utf-8','replace')
+    event_data['name'] = html.unescape(title).split('|')[0][:-1]
     tier = soup.find(class_='pane-tournament-event-info').find(class_='pane-content').find('h4').text
     event_data['tier'] = tier
     tournament_metadata = soup.find(class_='event-info')
@@ -98,104 +317,42 @@ def pdga_event(event_number:int,event_only:bool = False) -> pd.core.frame.DataFr
         event_data['players'] = int(status_metadata.find(class_='players').text)
     except:
         event_data['players'] = 0
-        print(event_data['Name'] + ' has not listed number of players.')
+        print(event_data['name'] + ' has not listed number of players.')
     try:
         event_data['purse'] = float(status_metadata.find(class_='purse').text.replace('$','').replace(',',''))
     except:
         event_data['purse'] = float(0)
         print(event_data['name'] + ' has no purse.')
 
-    if not event_only:
-        # parse the html for the tournaments, the results tables for each division are in a div containers with class 'table-container'
-        results = soup.find(class_='leaderboard')
-        # organize the tournaments into a list of dictionaries
-        all_tournaments = []
-        # parse through all divisions (categories)
-        categories = results.find_all('details')
-        idx = 0
-        finished = False
-        while not finished:
-            try:
-                category = categories[idx]
-                idx += 1
-                # extract the division
-                division = category.find(class_='division').text.split()[0]
-                # the table is broken into two classes for odd and even placement
-                tournaments_odd = category.find_all(class_='odd')
-                tournaments_even = category.find_all(class_='even')
-                # combine the two lists for full results
-                tournaments = [None]*(len(tournaments_odd)+len(tournaments_even))
-                tournaments[::2] = tournaments_odd
-                tournaments[1::2] = tournaments_even
-                for tournament in tournaments:
-                    tournament_dict = {}
-                    # player
-                    name = tournament.find(class_='player').text
-                    tournament_dict['name'] = name
-                    try:
-                        pdga_number = int(tournament.find(class_='pdga-number').text)
-                    except:
-                        pdga_number = 0
-                    tournament_dict['pdga_number'] = pdga_number
-                    # division
-                    tournament_dict['division'] = division
-                    # total
-                    try:
-                        total_score = int(tournament.find(class_='total').text)
-                    except:
-                        total_score = 999
-                    tournament_dict['total'] = total_score
-                    # place
-                    place = int(tournament.find(class_='place').text)
-                    tournament_dict['place'] = place
-                    # player rating
-                    try:
-                        player_rating = int(tournament.find(class_='player-rating').text)
-                    except:
-                        player_rating = 0
-                    tournament_dict['rating'] = player_rating
-                    # propagator
-                    if tournament.find(class_='propagator'):
-                        tournament_propagator = True
-                    else:
-                        tournament_propagator = False
-                    tournament_dict['propagator'] = tournament_propagator
-                    # rounds
-                    found_rounds = tournament.find_all(class_='round')
-                    rounds = []
-                    for round in found_rounds:
-                        rounds.append(round.text)
-                    tournament_dict['rounds'] = rounds
-                    # round ratings
-                    found_ratings = tournament.find_all(class_='round-rating')
-                    ratings = []
-                    for rating in found_ratings:
-                        ratings.append(rating.text)
-                    tournament_dict['ratings'] = ratings   
-                    try:
-                        prize = float(tournament.find(class_='prize').text.replace('$','').replace(',',''))
-                    except:
-                        prize = 0
-                    tournament_dict['prize'] = prize
-                    # append player and round information to leaderboard
-                    all_tournaments.append(tournament_dict)
-            except:
-                finished = True
-
-        # create a dataframe
-        tournaments_df = pd.DataFrame(all_tournaments)
-    else:
-        tournaments_df = pd.DataFrame()
-    return event_data, tournaments_df
+    # the rows of the leaderboard are timed while they are parsed
+    dbmetrics.record_parse(time.perf_counter() - start_time)
+    if event_only:
+        return event_data, pd.DataFrame() if as_frame else iter(())
+    results = iter_leaderboard(soup)
+    return event_data, results_frame(results) if as_frame else results
 
-def pdga_player(pdga_number:int) -> dict:
+# main functions
+def pdga_event(event_number:int,event_only:bool = False,as_frame:bool = True,max_age:float = None) -> pd.core.frame.DataFrame:
+    """
+    Scrapes the event metadata from the the pdga website, given the event number.
+    Returns a dictionary of event metadata and a pandas dataframe of tournaments,
+    or a generator of tournament results if as_frame is False. A cached page older than max_age seconds is revalidated.
+    """
+    print(colored('Scraping event {} from pdga website.'.format(str(event_number)),'red'))
+    # load the html of the event
+    web_address = 'https://www.pdga.com/tour/event/' + str(event_number)
+    return parse_event_page(fetch_page(web_address,'event',max_age=max_age),event_only,as_frame=as_frame)
+
+def pdga_player(pdga_number:int,min_interval:float=MIN_REQUEST_INTERVAL,max_age:float=None) -> dict:
     """
     Scrapes the pdga player's data, given the players pdga number.
+    A cached page older than max_age seconds is revalidated.
     """
     print(colored('Scraping player info from player ({}) at pdga website.'.format(pdga_number),'red'))
     web_address = 'https://www.pdga.com/player/' + str(pdga_number) + '/details'
-    page = requests.get(web_address)
-    soup = BeautifulSoup(page.content, 'html.parser')
+    content = fetch_page(web_address,'player',min_interval,max_age)
+    start_time = time.perf_counter()
+    soup = BeautifulSoup(content, PARSER)
 
     # parse the player metadata
     player_data = {}
@@ -238,4 +395,21 @@ def pdga_player(pdga_number:int) -> dict:
     except:
         player_data['career_earnings'] = float(0)
 
-    return player_data
\ No newline at end of file
+    dbmetrics.record_parse(time.perf_counter() - start_time)
+    return player_data
+
+def pdga_players(pdga_numbers:list,max_workers:int=MAX_WORKERS,min_interval:float=MIN_REQUEST_INTERVAL,max_age:float=None) -> dict:
+    """
+    Scrapes several pdga players concurrently through a bounded pool of threads.
+    Returns a dictionary of player data keyed by pdga number, players that could not be scraped are left out.
+    """
+    players = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(pdga_player,pdga_number,min_interval,max_age): pdga_number for pdga_number in pdga_numbers}
+        for future in as_completed(futures):
+            pdga_number = futures[future]
+            try:
+                players[pdga_number] = future.result()
+            except Exception as e:
+                print(colored('Scraping player {} failed: {}'.format(pdga_number,e),'red'))
+    return players
@@ -0,0 +1,167 @@
+# This file runs a whole season from a config file: ingestion of the events, sda licenses, points and standings
+from concurrent.futures import ThreadPoolExecutor
+from dbconn import get_session
+from dbobjects import Event, Player
+from dbinteract import write_event, poll_event, add_sda_info, calculate_swisstour_pts, create_standings, SDA_URL
+from dbsnapshot import run_snapshot
+from dbexport import export_season, EXPORT_DIR
+from dbscrape import pdga_event, pdga_players, write_file_atomic, MAX_WORKERS
+import dbmetrics
+import hashlib
+import json
+import os
+import threading
+import time
+
+# number of events that are fetched and parsed at the same time
+MAX_EVENT_WORKERS = int(os.getenv('PDGA_EVENT_WORKERS', 4))
+
+# seconds between two polls of an event in progress
+POLL_INTERVAL = 180
+
+# stages of the season pipeline, in the order they run
+STAGES = ['ingest','sda','points','standings','export']
+
+def load_season(path:str) -> dict:
+    """
+    Read a season config file. It is a json file with the season, the optional source of the sda licenses,
+    whether to publish the standings table of each division (wide_tables, true by default), the optional
+    directory of the export and the events in standings order, each with its event_id, max points and short name:
+    {"season": 2025, "events": [{"event_id": 87177, "points": 100, "name": "Chili Open"}, ...]}
+    """
+    with open(path,'rb') as f:
+        content = f.read()
+    season = json.loads(content)
+    event_ids = [int(n['event_id']) for n in season['events']]
+    if len(set(event_ids)) != len(event_ids):
+        raise ValueError(f'Duplicate event in the season config {path}')
+    season['event_order_and_pts'] = {int(n['event_id']): [n['points'], n['name']] for n in season['events']}
+    season['hash'] = hashlib.sha256(content).hexdigest()
+    return season
+
+def state_path(path:str) -> str:
+    """
+    Return the path of the file that records the completed stages of a season run.
+    """
+    return path + '.state'
+
+def read_state(path:str,season:dict) -> list:
+    """
+    Return the stages completed by an unfinished run of the same season config.
+    """
+    try:
+        with open(state_path(path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return state['completed'] if state.get('hash') == season['hash'] else []
+
+def write_state(path:str,season:dict,completed:list):
+    write_file_atomic(state_path(path),json.dumps({'hash': season['hash'], 'completed': completed}).encode())
+
+def fetch_event(event_id:int,claimed:set,lock,max_workers:int=MAX_WORKERS) -> tuple:
+    """
+    Scrape an event and the pdga players of its leaderboard that are not claimed yet by another event.
+    Returns the event data, the list of tournament results and the player data keyed by pdga number.
+    """
+    event_data, results = pdga_event(event_id,event_only=False,as_frame=False)
+    results = list(results)
+    with lock:
+        pdga_ids = sorted(set(int(n.pdga_number) for n in results if n.pdga_number) - claimed)
+        claimed.update(pdga_ids)
+    return event_data, results, pdga_players(pdga_ids,max_workers=max_workers)
+
+def ingest_events(event_ids:list,max_event_workers:int=MAX_EVENT_WORKERS,max_workers:int=MAX_WORKERS):
+    """
+    Ingest the events that are not in the database yet. The events and their players are scraped concurrently,
+    each event is written in a single commit, one after another and in the given order. An event with a player
+    that cannot be scraped is not written and raises, the events before it stay in the database.
+    """
+    with get_session() as session:
+        ingested = set(n for n, in session.query(Event.event_id).filter(Event.event_id.in_(event_ids)))
+        claimed = set(n for n, in session.query(Player.player_pdga_id).filter(Player.player_pdga_id.isnot(None)))
+    pending = [n for n in event_ids if n not in ingested]
+    print('{} of {} events are already in the database, ingesting {}.'.format(len(ingested),len(event_ids),len(pending)))
+    if not pending:
+        return
+
+    lock = threading.Lock()
+    players_data = {}
+    with ThreadPoolExecutor(max_workers=max_event_workers) as executor:
+        futures = [executor.submit(fetch_event,event_id,claimed,lock,max_workers) for event_id in pending]
+        for event_id, future in zip(pending,futures):
+            event_data, results, _ = future.result()
+            # players scraped for any event that is already fetched are reused, instead of being scraped again
+            for done in futures:
+                if done.done() and done.exception() is None:
+                    players_data.update(done.result()[2])
+            # a failed event is rolled back and fails the stage, so that the next run ingests it again
+            try:
+                with dbmetrics.stage('ingest',event_id=event_id):
+                    write_event(event_id,event_data,results,max_workers=max_workers,players_data=players_data)
+            except Exception:
+                print('Ingesting event {} failed, the season stops before the sda licenses and points.'.format(event_id))
+                raise
+            print('Ingested event {}.'.format(event_id))
+
+def run_season(path:str,full:bool=False,max_event_workers:int=MAX_EVENT_WORKERS,max_workers:int=MAX_WORKERS,
+               snapshot_url:str=None):
+    """
+    Run the season pipeline of a config file: ingest the events, sync the sda licenses, calculate the points,
+    create the standings and export them. The completed stages are recorded, so that a failed run continues
+    where it stopped when it is started again with the same config. With a snapshot_url the sda licenses, points
+    and standings are computed on a local sqlite snapshot of the database in one stage.
+    """
+    season = load_season(path)
+    event_order_and_pts = season['event_order_and_pts']
+    completed = read_state(path,season)
+    if completed:
+        print('Resuming season {} after the stages {}.'.format(season.get('season',''),', '.join(completed)))
+
+    stages = {'ingest': lambda: ingest_events(list(event_order_and_pts),max_event_workers,max_workers),
+              'sda': lambda: add_sda_info(season.get('sda_source',SDA_URL)),
+              'points': lambda: calculate_swisstour_pts(event_order_and_pts,full=full),
+              'standings': lambda: create_standings(event_order_and_pts,season=season.get('season'),
+                                                    wide=season.get('wide_tables',True)),
+              'snapshot': lambda: run_snapshot(event_order_and_pts,season.get('sda_source',SDA_URL),full=full,
+                                               snapshot_url=snapshot_url,season=season.get('season'),
+                                               wide=season.get('wide_tables',True)),
+              'export': lambda: export_season(season['season'],event_order_and_pts,season.get('export_dir',EXPORT_DIR))}
+    names = ['ingest','snapshot','export'] if snapshot_url else STAGES
+    # the export needs the standings of a season
+    if season.get('season') is None:
+        names = [n for n in names if n != 'export']
+    for name in names:
+        if name in completed:
+            continue
+        stages[name]()
+        completed.append(name)
+        write_state(path,season,completed)
+
+    # the run is complete, the next run starts from the beginning
+    os.remove(state_path(path))
+
+def run_live(path:str,event_id:int,interval:float=POLL_INTERVAL,max_polls:int=None):
+    """
+    Poll an event of the season in progress every interval seconds and update the points, standings and export
+    of the divisions whose leaderboard changed. A failed poll, e.g. a player that cannot be scraped, writes nothing
+    and is retried at the next interval.
+    """
+    season = load_season(path)
+    if event_id not in season['event_order_and_pts']:
+        raise ValueError(f'Event {event_id} is not in the season config {path}')
+    fingerprints = {}
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        try:
+            fingerprints = poll_event(event_id,season['event_order_and_pts'],fingerprints,
+                                      season=season.get('season'),wide=season.get('wide_tables',True),
+                                      sda_source=season.get('sda_source',SDA_URL))
+            # only the files of changed standings are written again
+            if season.get('season') is not None:
+                export_season(season['season'],season['event_order_and_pts'],season.get('export_dir',EXPORT_DIR))
+        except Exception as e:
+            print('Polling event {} failed: {}'.format(event_id,e))
+        polls += 1
+        if max_polls is None or polls < max_polls:
+            time.sleep(interval)
@@ -0,0 +1,163 @@
+# This file serves the standings of a season as json over http from memory, so that page views do not query the database
+from dbexport import season_frames, frame_hash
+from dbseason import load_season
+import argparse
+import asyncio
+import hashlib
+import json
+import urllib.parse
+
+# seconds between two checks for a new version of the served data
+REFRESH_INTERVAL = 30
+
+# the served responses keyed by path and the version of the data they were built from
+_state = {'version': None, 'responses': {}}
+
+def published_version(frames:dict) -> str:
+    """
+    Return the version of the served data of a season, it changes with any served value: the standings,
+    the points of an event, the results of a tournament or the name of a player.
+    """
+    return hashlib.sha256(repr([(key, frame_hash(frames[key])) for key in sorted(frames)]).encode()).hexdigest()
+
+def records(df) -> list:
+    """
+    Convert a dataframe to a list of dictionaries with None for missing values.
+    """
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def json_response(data) -> tuple:
+    """
+    Serialize a response and return its body and its etag.
+    """
+    body = json.dumps(data, default=lambda x: x.item() if hasattr(x, 'item') else str(x)).encode()
+    return body, '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+
+def build_responses(season:int,event_order_and_pts:dict,frames:dict) -> dict:
+    """
+    Build the responses of all paths from the standings and tournaments frames of a season:
+    /standings lists the divisions, /standings/<division> the standings of a division,
+    /players/<player_id> the event breakdown of a player and /events/<event_id> the results of an event.
+    """
+    events = [{'event_id': event_id, 'event_name': name, 'max_pts': max_pts} for event_id, (max_pts, name) in event_order_and_pts.items()]
+    divisions = sorted(division for dataset, division in frames if dataset == 'standings')
+    responses = {'/standings': {'season': season, 'divisions': divisions, 'events': events}}
+    players, results = {}, {}
+    for division in divisions:
+        standing_events = frames.get(('standing_events', division))
+        breakdown = {}
+        if standing_events is not None:
+            for row in records(standing_events):
+                breakdown.setdefault(row.pop('player_id'), []).append(row)
+        standings = []
+        for row in records(frames[('standings', division)]):
+            row['events'] = breakdown.get(row['player_id'], [])
+            standings.append(row)
+            player = players.setdefault(row['player_id'], {key: row[key] for key in ['player_id','pdga_number','firstname','lastname']})
+            player.setdefault('standings', []).append({'division': division, **{key: row[key] for key in ['place','total','events']}})
+        responses[f'/standings/{division}'] = {'season': season, 'division': division, 'standings': standings}
+    for (dataset, division), df in frames.items():
+        if dataset == 'tournaments':
+            for row in records(df):
+                results.setdefault(row['event_id'], []).append({'division': division, **row})
+    for player_id, player in players.items():
+        responses[f'/players/{player_id}'] = {'season': season, **player}
+    for event in events:
+        if event['event_id'] in results:
+            responses['/events/{}'.format(event['event_id'])] = {'season': season, **event, 'results': results[event['event_id']]}
+    return {path: json_response(data) for path, data in responses.items()}
+
+def refresh(season:int,event_order_and_pts:dict) -> bool:
+    """
+    Build the responses again if the served data of the season changed. Returns whether they changed.
+    """
+    global _state
+    frames = season_frames(season, event_order_and_pts)
+    version = published_version(frames)
+    if version == _state['version']:
+        return False
+    _state = {'version': version, 'responses': build_responses(season, event_order_and_pts, frames)}
+    print(f'Serving version {version[:12]} of the data of {season}.')
+    return True
+
+def respond(method:str,target:str,headers:dict) -> tuple:
+    """
+    Answer a request from the served responses. Returns the status, the headers and the body.
+    """
+    if method not in ('GET', 'HEAD'):
+        return '405 Method Not Allowed', {'Allow': 'GET, HEAD'}, b''
+    path = urllib.parse.urlsplit(target).path.rstrip('/') or '/'
+    responses = _state['responses']
+    if _state['version'] is None:
+        return '503 Service Unavailable', {'Retry-After': str(REFRESH_INTERVAL)}, b''
+    if path not in responses:
+        return '404 Not Found', {'Content-Type': 'application/json'}, json.dumps({'error': f'{path} not found'}).encode()
+    body, etag = responses[path]
+    response_headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Access-Control-Allow-Origin': '*'}
+    if_none_match = headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [n.strip().removeprefix('W/') for n in if_none_match.split(',')]):
+        return '304 Not Modified', response_headers, b''
+    return '200 OK', {**response_headers, 'Content-Type': 'application/json'}, body
+
+async def handle_request(reader,writer):
+    """
+    Read one http request and write the response, the connection is closed afterwards.
+    """
+    try:
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        status, response_headers, body = respond(method, target, headers)
+    except ValueError:
+        status, response_headers, body = '400 Bad Request', {}, b''
+        method = 'GET'
+    response_headers = {**response_headers, 'Content-Length': str(len(body)), 'Connection': 'close'}
+    head = 'HTTP/1.1 {}\r\n{}\r\n\r\n'.format(status, '\r\n'.join(f'{name}: {value}' for name, value in response_headers.items()))
+    writer.write(head.encode('latin-1') + (body if method != 'HEAD' else b''))
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def refresh_loop(season:int,event_order_and_pts:dict,interval:float):
+    """
+    Check for a new version of the served data every interval seconds. While the database cannot be reached,
+    the responses of the last version are served.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(refresh, season, event_order_and_pts)
+        except Exception as e:
+            print(f'Refreshing the standings failed: {e}')
+        await asyncio.sleep(interval)
+
+async def serve(path:str,host:str='127.0.0.1',port:int=8000,interval:float=REFRESH_INTERVAL):
+    """
+    Serve the standings of the season of a config file until the process is stopped.
+    """
+    season = load_season(path)
+    if season.get('season') is None:
+        raise ValueError(f'The season config {path} has no season')
+    refresher = asyncio.create_task(refresh_loop(season['season'], season['event_order_and_pts'], interval))
+    server = await asyncio.start_server(handle_request, host, port)
+    print(f'Serving the standings of {season["season"]} on http://{host}:{port}/standings')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        refresher.cancel()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the standings of a season as json from memory.')
+    parser.add_argument('--season', default='season_2025.json', help='season config file with the events, their max points and short names')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help='seconds between two checks for changed standings, results or players')
+    args = parser.parse_args()
+    asyncio.run(serve(args.season, args.host, args.port, args.interval))
@@ -0,0 +1,92 @@
+# This file computes the sda licenses, points and standings on a local sqlite snapshot of the database
+# and writes back only what changed, so that a remote database is read and written in a few bulk statements
+from sqlalchemy import create_engine, make_url, select, insert, update, tuple_
+from dbconn import get_engine, get_session, use_engine
+from dbobjects import Base, Player, Event, Tournament, PointsState, SyncState
+from dbinteract import (add_sda_info, calculate_swisstour_pts, tournament_divisions, standings_frames, standing_rows,
+                        publish_standings_table, publish_standing_rows, SDA_URL, BATCH_SIZE)
+from dbmetrics import timed_stage
+
+# tables copied to the snapshot, in the order of their foreign keys
+SNAPSHOT_MODELS = [Player, Event, Tournament, PointsState, SyncState]
+
+def primary_key(model) -> list:
+    return list(model.__table__.primary_key.columns.keys())
+
+@timed_stage('snapshot')
+def create_snapshot(snapshot_url:str='sqlite://') -> tuple:
+    """
+    Copy the players, events, tournaments and calculation states of the database into a new sqlite database,
+    in memory by default, with one select per table.
+    Returns the engine of the snapshot and the copied rows of each model keyed by primary key.
+    """
+    # the tables of the snapshot are dropped first, so it must never point to another database
+    if make_url(snapshot_url).get_backend_name() != 'sqlite':
+        raise ValueError(f'The snapshot must be a sqlite database, not {make_url(snapshot_url).render_as_string(hide_password=True)}')
+    snapshot = create_engine(snapshot_url)
+    Base.metadata.drop_all(snapshot)
+    Base.metadata.create_all(snapshot)
+    copied = {}
+    with get_engine().connect() as connection, snapshot.begin() as snapshot_connection:
+        for model in SNAPSHOT_MODELS:
+            table = model.__table__
+            rows = [dict(n) for n in connection.execute(select(table)).mappings()]
+            for start in range(0,len(rows),BATCH_SIZE):
+                snapshot_connection.execute(insert(table),rows[start:start+BATCH_SIZE])
+            key = primary_key(model)
+            copied[model] = {tuple(n[k] for k in key): n for n in rows}
+    print('Copied {} to the snapshot.'.format(', '.join('{} {}'.format(len(rows),model.__tablename__) for model, rows in copied.items())))
+    return snapshot, copied
+
+@timed_stage('write_back')
+def write_back(snapshot,copied:dict):
+    """
+    Write the changes made in the snapshot back to the database in one transaction: the changed columns of changed rows
+    with one bulk update per table, new rows with bulk inserts and removed rows with one delete per table.
+    """
+    with snapshot.connect() as snapshot_connection, get_session() as session:
+        for model in SNAPSHOT_MODELS:
+            key = primary_key(model)
+            before = copied[model]
+            after = {tuple(n[k] for k in key): dict(n) for n in snapshot_connection.execute(select(model.__table__)).mappings()}
+            changes = []
+            for pk, row in after.items():
+                if pk in before:
+                    change = {column: value for column, value in row.items() if before[pk][column] != value}
+                    if change:
+                        changes.append({**{k: row[k] for k in key}, **change})
+            new_rows = [row for pk, row in after.items() if pk not in before]
+            removed = [pk for pk in before if pk not in after]
+            if changes:
+                session.execute(update(model),changes)
+            for start in range(0,len(new_rows),BATCH_SIZE):
+                session.execute(insert(model),new_rows[start:start+BATCH_SIZE])
+            if removed:
+                columns = [getattr(model,k) for k in key]
+                session.query(model).filter(tuple_(*columns).in_(removed)).delete(synchronize_session=False)
+            if changes or new_rows or removed:
+                print('Wrote back {} changed, {} new and {} removed {}.'.format(len(changes),len(new_rows),len(removed),model.__tablename__))
+        session.commit()
+
+def run_snapshot(event_order_and_pts:dict,sda_source:str=SDA_URL,full:bool=False,snapshot_url:str='sqlite://',
+                 season:int=None,wide:bool=True):
+    """
+    Sync the sda licenses, calculate the points and build the standings on a snapshot of the database,
+    then write back the changed players, points and calculation states and publish the standings that changed.
+    season and wide select the standings that are published like for create_standings.
+    """
+    snapshot, copied = create_snapshot(snapshot_url)
+    try:
+        with use_engine(snapshot):
+            add_sda_info(sda_source)
+            calculate_swisstour_pts(event_order_and_pts,full=full)
+            rows = {division: standing_rows(division,event_order_and_pts) for division in tournament_divisions()} if season is not None else {}
+            frames = standings_frames(event_order_and_pts) if wide else {}
+        write_back(snapshot,copied)
+    finally:
+        snapshot.dispose()
+    # unchanged standings are skipped by their hash
+    for division, division_rows in rows.items():
+        publish_standing_rows(season,division,division_rows)
+    for division, points_df in frames.items():
+        publish_standings_table(division,points_df)
@@ -1,50 +1,49 @@
-from dbinteract import populate_db_by_event, add_sda_info, calculate_swisstour_pts, create_standings
+from dbseason import run_season, run_live, MAX_EVENT_WORKERS, POLL_INTERVAL
+from dbinteract import refresh_player_profiles
+from dbconn import check_connection
+from dbobjects import init_schema
+import dbmetrics
+import argparse
 import time
 
-def main():
+def main(season:str='season_2025.json',full:bool=False,report:str=None,max_event_workers:int=MAX_EVENT_WORKERS,
+         refresh_players:float=None,snapshot:str=None):
     # time the execution
     start_time = time.time()
 
-    # define the event order and points for standings table
-    event_order_and_pts = {87177:[100,"Chili Open"],  # Chili Open
-                           89585:[200, "Revolution"],  # Revolution
-                           90064:[100, "Spring Clang"],  # Spring Clang MPO/FPO
-                           90024:[100, "Spring Clang"],  # Spring Clang Other
-                           91659:[100, "GPO"],  # GPO
-                           91840:[100, "Birdie Fest"],  # Birdie Fest
-                           92323:[200, "ZDGO"],  # ZDGO
-                           92343:[250, "Meggen (Swiss Championships)"],  # Meggen
-                           93590:[100, "Samnaun"],  # Samnaun
-                           94300:[100, "Lila's Open"],  # Lila's
-                           94089:[200, "Eagle Open"],  # Eagle Open
-                           95048:[100,"Lakeside Open"],  # Lakeside
-                           ##95510:[250,"Bern Open"]   # Bern Open
-                           }  
-    
-    # populate the database with the results of the events
-    # populate_db_by_event(87177)                   # Chili Open
-    # populate_db_by_event(89585)                   # Revolution
-    # populate_db_by_event(90064)                   # Spring Clang MPO/FPO
-    # populate_db_by_event(90024)                   # Spring Clang Other
-    # populate_db_by_event(91659)                   # GPO
-    # populate_db_by_event(91840)                   # Birdie Fest
-    # populate_db_by_event(92323)                   # ZDGO
-    # populate_db_by_event(92343)                   # Meggen
-    # populate_db_by_event(93590)                   # Samnaun
-    # populate_db_by_event(94300)                   # Lila's
-    # populate_db_by_event(94089)                   # Eagle Open
-    # populate_db_by_event(95048)                   # Lakeside
-    populate_db_by_event(95510)                   # Bern Open
+    # connect to the database and create the tables that do not exist yet
+    check_connection()
+    init_schema()
 
-    add_sda_info()
+    # the events, their max points and short names are defined in the season config file
+    run_season(season,full=full,max_event_workers=max_event_workers,snapshot_url=snapshot)
 
-    calculate_swisstour_pts(event_order_and_pts)
-
-    create_standings(event_order_and_pts)
+    # scrape the player profiles again that are older than the given number of days
+    if refresh_players is not None:
+        refresh_player_profiles(max_age_days=refresh_players)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"Elapsed time: {elapsed_time:.2f} seconds")
 
+    # write the timings and counters of the run
+    if report:
+        dbmetrics.write_report(report)
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Populate the database and create the swisstour standings.')
+    parser.add_argument('--season', default='season_2025.json', help='season config file with the events, their max points and short names')
+    parser.add_argument('--full', action='store_true', help='recompute the points of all events instead of only the changed ones')
+    parser.add_argument('--report', help='write the timings and counters of the run to this json or csv file')
+    parser.add_argument('--event-workers', type=int, default=MAX_EVENT_WORKERS, help='number of events fetched and parsed at the same time')
+    parser.add_argument('--live', type=int, metavar='EVENT_ID', help='poll an event in progress and update its standings until interrupted')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds between two polls of the live event')
+    parser.add_argument('--refresh-players', type=float, nargs='?', const=7, metavar='DAYS', help='scrape again the player profiles older than DAYS days (7 by default)')
+    parser.add_argument('--snapshot', nargs='?', const='sqlite://', metavar='URL', help='compute the sda licenses, points and standings on a local sqlite snapshot (in memory by default) and write back only the changes')
+    args = parser.parse_args()
+    if args.live:
+        init_schema()
+        run_live(args.season,args.live,interval=args.interval)
+    else:
+        main(season=args.season,full=args.full,report=args.report,max_event_workers=args.event_workers,
+             refresh_players=args.refresh_players,snapshot=args.snapshot)